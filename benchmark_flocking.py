@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the step kernels over flock size n, dimension d and mode. Results are written
+as json, such that runs on different commits can be compared:
+
+    python benchmark_flocking.py --output new.json --compare old.json
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+import flocking_engine
+import flocking_behaviour_basic_pred_food as pred_food
+
+
+def make_param(d):
+    '''
+    Parameters shared by all benchmarks
+    '''
+    return {"d": d, "ax_lim": (-50, 50), "center_pull": 1.5, "predator_push": -0.5,
+            "predator_pull": 1.5, "food_pull": 0.1}
+
+def make_step(mode, n, d, rng):
+    '''
+    Builds the state of one benchmark case and returns a function running the step kernel on it.
+    The state is not advanced, the cost of the kernels does not depend on the positions.
+
+    Parameters
+    ----------
+    mode : str
+        "update", "update_predator" (with the number of predators, e.g. "update_predator:16")
+        or "pred_food" with its variant, e.g. "pred_food:pred+food".
+    n : int
+        number of agents.
+    d : int
+        number of dimensions.
+    rng : np.random.Generator
+
+    Returns
+    -------
+    step : callable
+        one call of the step kernel.
+
+    '''
+    param = make_param(d)
+    agent_now = rng.uniform(-1, 1, size=(n, d))
+    agent_old = agent_now - rng.normal(scale=0.01, size=(n, d))
+    buffers = flocking_engine.allocate_buffers(n, d)
+
+    if mode == "update":
+        def step():
+            flocking_engine.update(agent_now, agent_old, param, buffers)
+    elif mode.startswith("update_predator"):
+        if ":" in mode:
+            param["predator_xy"] = rng.uniform(-50, 50, size=(int(mode.split(":")[1]), d))
+        else:
+            param["predator_xy"] = np.full(d, 49.0)
+        def step():
+            flocking_engine.update_predator(agent_now, agent_old, param, buffers)
+    elif mode.startswith("pred_food"):
+        variant = mode.split(":")[1]
+        kwargs = {}
+        if "pred" in variant.split("+"):
+            kwargs["double_agent_now"] = rng.uniform(-11, -9, size=(1, d))
+            kwargs["double_agent_old"] = rng.uniform(-11, -9, size=(1, d))
+        if "food" in variant.split("+"):
+            kwargs["food_coord"] = rng.uniform(-50, 50, size=(1, d))
+        def step():
+            pred_food.update(agent_now, agent_old, param, buffers=buffers, **kwargs)
+    else:
+        raise ValueError(f"Unknown mode {mode}.")
+
+    return step
+
+def run_case(mode, n, d, min_time = 0.2, max_steps = 1000, repeats = 5, seed = 0):
+    '''
+    Times the steps of one case in repeats blocks, which together last at least min_time, and
+    measures the peak memory allocated by numpy during a step. The fastest block is reported,
+    it is the least disturbed by other processes.
+
+    Returns
+    -------
+    result : dict
+        steps_per_sec, agent_steps_per_sec and peak_memory_bytes of the case.
+
+    '''
+    step = make_step(mode, n, d, np.random.default_rng(seed))
+    # warm up, the first step allocates lazily created arrays
+    step()
+
+    total_steps = 0
+    steps_per_sec = 0
+    for repeat in range(repeats):
+        steps = 0
+        start = time.perf_counter()
+        while steps < max_steps // repeats + 1 and (steps == 0 or time.perf_counter() - start < min_time / repeats):
+            step()
+            steps += 1
+        steps_per_sec = max(steps_per_sec, steps / (time.perf_counter() - start))
+        total_steps += steps
+
+    tracemalloc.start()
+    step()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"mode": mode, "n": n, "d": d, "steps": total_steps,
+            "steps_per_sec": steps_per_sec,
+            "agent_steps_per_sec": n * steps_per_sec,
+            "peak_memory_bytes": peak}
+
+def environment():
+    '''
+    Commit, numpy and python versions of a benchmark run
+    '''
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True,
+                                check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {"commit": commit, "numpy": np.__version__, "python": platform.python_version(),
+            "machine": platform.machine(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def run_benchmarks(modes, ns, ds, min_time = 0.2):
+    '''
+    Runs all combinations of modes, flock sizes and dimensions
+
+    Returns
+    -------
+    report : dict
+        environment and list of results of run_case.
+
+    '''
+    results = []
+    for mode in modes:
+        for d in ds:
+            for n in ns:
+                result = run_case(mode, n, d, min_time = min_time)
+                print(f"{mode:24s} d={d} n={n:>8d}  {result['steps_per_sec']:10.1f} steps/s  "
+                      f"{result['agent_steps_per_sec']:.3g} agent-steps/s  "
+                      f"{result['peak_memory_bytes'] / 2**20:8.1f} MiB")
+                results.append(result)
+
+    return {"environment": environment(), "results": results}
+
+def compare_reports(old, new, tolerance = 0.1):
+    '''
+    Lists the cases that got slower by more than tolerance (relative) between two reports
+
+    Returns
+    -------
+    regressions : list of dict
+        mode, n, d and the old and new steps per second.
+
+    '''
+    old_results = {(r["mode"], r["n"], r["d"]): r for r in old["results"]}
+    regressions = []
+    for result in new["results"]:
+        key = (result["mode"], result["n"], result["d"])
+        if key not in old_results:
+            continue
+        old_speed = old_results[key]["steps_per_sec"]
+        if result["steps_per_sec"] < (1 - tolerance) * old_speed:
+            regressions.append({"mode": key[0], "n": key[1], "d": key[2],
+                                "old_steps_per_sec": old_speed, "new_steps_per_sec": result["steps_per_sec"]})
+
+    return regressions
+
+
+MODES = ["update", "update_predator",
+         "pred_food:basic", "pred_food:pred", "pred_food:food", "pred_food:pred+food"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the flocking step kernels.")
+    parser.add_argument("--modes", nargs = "+", default = MODES)
+    parser.add_argument("--n", nargs = "+", type = int, default = [10**2, 10**3, 10**4, 10**5, 10**6])
+    parser.add_argument("--d", nargs = "+", type = int, default = [2, 3])
+    parser.add_argument("--min-time", type = float, default = 0.2, help = "seconds timed per case")
+    parser.add_argument("--output", default = "benchmark.json")
+    parser.add_argument("--compare", help = "earlier report, exit with 1 if a case got slower")
+    parser.add_argument("--tolerance", type = float, default = 0.1)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.modes, args.n, args.d, min_time = args.min_time)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent = 1)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare_reports(json.load(file), report, tolerance = args.tolerance)
+        for r in regressions:
+            print(f"slower: {r['mode']} d={r['d']} n={r['n']}: "
+                  f"{r['old_steps_per_sec']:.1f} -> {r['new_steps_per_sec']:.1f} steps/s")
+        sys.exit(1 if regressions else 0)
@@ -1,50 +1,36 @@
 import os
+import time
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 # from mpl_toolkits.mplot3d import Axes3D
-from matplotlib.animation import FuncAnimation
+# the step kernels live in the headless engine, they are re-exported here
+from flocking_engine import (initialize_agents, euclidian_dist, allocate_buffers, verlet_step, add_pull,
+                             periodic_boundaries, center_of_mass, update, update_predator, run_simulation,
+                             resume_simulation)
+from flocking_render import render_video
 
 
-def initialize_random(param):
+def initialize_figure(param):
     '''
-    This function initializes the agents, as well as the plotting window
+    Creates the plotting window
 
     Parameters
     ----------
     param : dict
         Holds the necessary parameters.
 
-    Raises
-    ------
-    ValueError
-        Dimension is not supplied or invalid.
-
     Returns
     -------
-    agent_old : np.ndarray
-        Zeros.
-    agent_now : np.ndarray
-        Initial positions of agents.
     fig : figure object
         Figure to plot in.
     ax : artist object
         Artist axis to plot in.
 
     '''
-    n = param["n"]
     d = param["d"]
-    low, high = param["init_coord"]
     lower_lim, upper_lim = param["ax_lim"]
     
-
-    # initialize n agents in d dimensions
-    
-    
-    agent_now = np.random.uniform(low=low, high=high, size=(n, d))
-    agent_old = np.zeros_like(agent_now)
-    agent_temp = np.zeros_like(agent_now)
-    
     if d == 2: 
         # some fig to plot
         fig = plt.figure()
@@ -60,9 +46,9 @@ def initialize_random(param):
     else:
         raise ValueError("Incorrect number of dimensions. Choose d=2 or d=3.")
 
-    return agent_old, agent_now, fig, ax, param
+    return fig, ax
 
-def initialize_predator(param):
+def initialize_random(param, plotting = True):
     '''
     This function initializes the agents, as well as the plotting window
 
@@ -70,6 +56,8 @@ def initialize_predator(param):
     ----------
     param : dict
         Holds the necessary parameters.
+    plotting : bool, optional
+        create the figure to plot in, otherwise fig and ax are None. The default is True.
 
     Raises
     ------
@@ -83,39 +71,46 @@ def initialize_predator(param):
     agent_now : np.ndarray
         Initial positions of agents.
     fig : figure object
-        Figure to plot in.
+        Figure to plot in (or None).
     ax : artist object
-        Artist axis to plot in.
+        Artist axis to plot in (or None).
 
     '''
-    n = param["n"]
-    d = param["d"]
-    low, high = param["init_coord"]
-    lower_lim, upper_lim = param["ax_lim"]
-    
+    agent_old, agent_now, param = initialize_agents(param)
+    fig, ax = initialize_figure(param) if plotting else (None, None)
 
-    # initialize n agents in d dimensions
-    
-    
-    agent_now = np.random.uniform(low=low, high=high, size=(n, d))
-    agent_old = np.zeros_like(agent_now)
-    param["predator_xy"] = np.random.choice([lower_lim + 1, upper_lim - 1], size = 2, replace = True)
-    agent_temp = np.zeros_like(agent_now)
-    
-    if d == 2: 
-        # some fig to plot
-        fig = plt.figure()
-        ax = fig.add_subplot(1, 1, 1)
-        ax.set_xlim(lower_lim, upper_lim)
-        ax.set_ylim(lower_lim, upper_lim)
-    elif d == 3: 
-        fig = plt.figure()
-        ax = fig.add_subplot(1, 1, 1, projection = "3d")
-        ax.set_xlim(lower_lim, upper_lim)
-        ax.set_ylim(lower_lim, upper_lim)
-        ax.set_zlim(lower_lim, upper_lim)
-    else:
-        raise ValueError("Incorrect number of dimensions. Choose d=2 or d=3.")
+    return agent_old, agent_now, fig, ax, param
+
+def initialize_predator(param, plotting = True):
+    '''
+    This function initializes the agents and the predator, as well as the plotting window
+
+    Parameters
+    ----------
+    param : dict
+        Holds the necessary parameters.
+    plotting : bool, optional
+        create the figure to plot in, otherwise fig and ax are None. The default is True.
+
+    Raises
+    ------
+    ValueError
+        Dimension is not supplied or invalid.
+
+    Returns
+    -------
+    agent_old : np.ndarray
+        Zeros.
+    agent_now : np.ndarray
+        Initial positions of agents.
+    fig : figure object
+        Figure to plot in (or None).
+    ax : artist object
+        Artist axis to plot in (or None).
+
+    '''
+    agent_old, agent_now, param = initialize_agents(param, predator = True)
+    fig, ax = initialize_figure(param) if plotting else (None, None)
 
     return agent_old, agent_now, fig, ax, param
 
@@ -193,93 +188,103 @@ def inline_plot_3D_basic(agent_now, ax, param):
     
     return ax
 
-def euclidian_dist(array, axis):
-
-    return np.sqrt(np.sum(array**2, axis = axis))
-
-def update(agent_now, agent_old, param):
+class LiveRenderer:
     '''
-    Update of the postion of the agents, with the assumption that their acceleretion is computed from
-    their pull towards the center of mass and the delta between their new and old position
-    Parameters
-    ----------
-    agent_now : array (n, d)
-        DESCRIPTION.
-    agent_old : array (n, d)
-        DESCRIPTION.
-    center_pull : int, optional
-        DESCRIPTION. The default is 1.5.
+    Live plot of a running simulation, used as observer of the engine. The artists are created
+    once and only their offsets change; in 2D only the artists are redrawn on top of a cached
+    background (blitting). Rendering is decoupled from the simulation: only every
+    render_every-th step is drawn, and at most max_fps frames per second.
 
-    Returns
-    -------
-    agent_temp : updated positon of agents
-
-    '''
-    d = param["d"]
-    center_pull = param["center_pull"]
-    lower_lim, upper_lim = param["ax_lim"]
-    
-    agent_temp = np.zeros_like(agent_now)
-    # calculate center of mass
-    C = np.mean(agent_now, axis=0)
-
-    # update the agent position according to acceleration to center
-    for j in range(d):
-        agent_temp[:, j] = 2 * agent_now[:, j] - agent_old[:, j] + \
-            center_pull * (C[j] - agent_now[:, j]) / euclidian_dist((C - agent_now), axis = 1)
-            
-    # periodic boundary conditions by calculating delta in bracket and adding it to opposite mean
-    agent_plot = np.where(agent_temp < lower_lim, 
-                          upper_lim + (agent_temp + upper_lim), 
-                          np.where(agent_temp > upper_lim, lower_lim + (agent_temp + lower_lim), agent_temp)
-                          )
-    # returning an array for plotting a one with accurate positions, such that periodic boundaries do not intetfere with CoM calculations
-    return agent_temp, agent_plot, param
-
-def update_predator(agent_now, agent_old, param):
-    '''
-    Update of the postion of the agents, with the assumption that their acceleretion is computed from
-    their pull towards the center of mass and the delta between their new and old position
     Parameters
     ----------
-    agent_now : array (n, d)
-        DESCRIPTION.
-    agent_old : array (n, d)
-        DESCRIPTION.
-    center_pull : int, optional
-        DESCRIPTION. The default is 1.5.
-
-    Returns
-    -------
-    agent_temp : updated positon of agents
+    fig : figure object
+    ax : artist object
+        axis from initialize_figure.
+    param : dict
+        Holds the necessary parameters.
+    predator : bool, optional
+        also draw param["predator_xy"]. The default is False.
+    render_every : int, optional
+        draw every render_every-th step. The default is 1.
+    max_fps : float, optional
+        skip steps that would exceed this frame rate. The default is None (no limit).
 
     '''
-    d = param["d"]
-    center_pull = param["center_pull"]
-    lower_lim, upper_lim = param["ax_lim"]
-    predator_push = param["predator_push"]
-    predator_pull = param["predator_pull"]
-    
-    agent_temp = np.zeros_like(agent_now)
-    # calculate center of mass
-    C = np.mean(agent_now, axis=0)
-
-    # update the agent position according to acceleration to center
-    for j in range(d):
-        agent_temp[:, j] = 2 * agent_now[:, j] - agent_old[:, j] + \
-            center_pull * (C[j] - agent_now[:, j]) / euclidian_dist((C - agent_now), axis = 1) \
-            + predator_push * (param["predator_xy"][j] - agent_now[:, j]) / euclidian_dist((param["predator_xy"] - agent_now), axis = 1)
-            
-        param["predator_xy"][j] =  predator_pull * (param["predator_xy"][j] - C[j]) / euclidian_dist((param["predator_xy"] - C), axis = 0)
-            
-    # periodic boundary conditions by calculating delta in bracket and adding it to opposite mean
-    agent_plot = np.where(agent_temp < lower_lim, 
-                          upper_lim + (agent_temp + upper_lim), 
-                          np.where(agent_temp > upper_lim, lower_lim + (agent_temp + lower_lim), agent_temp)
-                          )
-    # returning an array for plotting a one with accurate positions, such that periodic boundaries do not intetfere with CoM calculations
-    return agent_temp, agent_plot, param
-    
+    def __init__(self, fig, ax, param, predator = False, render_every = 1, max_fps = None):
+        self.fig = fig
+        self.ax = ax
+        self.d = param["d"]
+        self.predator = predator
+        self.render_every = render_every
+        self.min_frame_time = 0 if max_fps is None else 1 / max_fps
+        self.last_frame = -np.inf
+        # blitting of 3D axes does not redraw the projection, they are redrawn completely
+        self.blit = self.d == 2 and fig.canvas.supports_blit
+        self.background = None
+
+        empty = [[] for j in range(self.d)]
+        self.agents = ax.scatter(*empty, s = param["pointsize"], animated = self.blit)
+        self.artists = [self.agents]
+        if predator:
+            self.predator_artist = ax.scatter(*empty, s = param["pointsize"] * 4, c = "red",
+                                              label = "predator", animated = self.blit)
+            self.artists.append(self.predator_artist)
+            ax.legend()
+
+        fig.canvas.mpl_connect("draw_event", self.on_draw)
+        plt.show(block = False)
+        fig.canvas.draw()
+
+    def on_draw(self, event):
+        '''
+        Caches the background after every full redraw (e.g. when the window is resized)
+        '''
+        if self.blit:
+            self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+            self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+
+    def set_offsets(self, artist, positions):
+        if self.d == 2:
+            artist.set_offsets(positions)
+        else:
+            artist._offsets3d = (positions[:, 0], positions[:, 1], positions[:, 2])
+
+    def wants_frame(self, i):
+        # decided before step i, such that the engine only wraps the frames that are drawn
+        if (i + 1) % self.render_every:
+            return False
+        now = time.perf_counter()
+        if now - self.last_frame < self.min_frame_time:
+            return False
+        self.last_frame = now
+        return True
+
+    def __call__(self, i, agent_plot, param):
+        # observer of the engine, called after step i, agent_plot is None for skipped steps
+        if agent_plot is None:
+            return
+        self.render(agent_plot, param)
+
+    def render(self, agent_plot, param):
+        '''
+        Draws the positions of one step
+        '''
+        self.set_offsets(self.agents, agent_plot)
+        if self.predator:
+            self.set_offsets(self.predator_artist, np.atleast_2d(param["predator_xy"]))
+
+        canvas = self.fig.canvas
+        if self.blit and self.background is not None:
+            canvas.restore_region(self.background)
+            self.draw_artists()
+            canvas.blit(self.fig.bbox)
+        else:
+            canvas.draw_idle()
+        canvas.flush_events()
 
 def simulate_flocking(mode = "basic",
                       inline_plotting = True,
@@ -291,7 +296,18 @@ def simulate_flocking(mode = "basic",
                                "center_pull": 1.5, 
                                "pointsize": 2, 
                                "predator_push": 1.5,
-                               "predator_pull": 1.5}): 
+                               "predator_pull": 1.5,
+                               "interaction": "global",
+                               "neighbour_radius": 5,
+                               "k_neighbours": 7},
+                      trajectory_file = None,
+                      stride = 1,
+                      render_every = 1,
+                      max_fps = 30,
+                      backend = "numpy",
+                      dtype = np.float64,
+                      checkpoint_file = None,
+                      checkpoint_every = 1000): 
     '''
 
     Parameters
@@ -300,194 +316,101 @@ def simulate_flocking(mode = "basic",
         number of agents. The default is 100.
     init_coord : tuple, optional
         Range of initialization of agents. The default is (-1, 1).
+    init : str, optional
+        initial pattern of the agents: "uniform", "gaussian", "mixture" (clusters), "lattice",
+        "halton" or "sobol", see flocking_init.initial_positions. The default is "uniform".
     steps : int, optional
         number of simulation steps. The default is 100.
     center_pull : float, optional
         pull factor towards center of mass. The default is 1.5.
+    interaction : str, optional
+        "global" pulls every agent towards the center of mass of the whole flock, "radius"
+        towards the center of mass of its flockmates within neighbour_radius, "knn" towards the
+        center of mass of its k_neighbours nearest flockmates. The default is "global".
+    knn_extra : int, optional
+        candidates kept beyond the k_neighbours nearest, such that the KD-tree of the "knn"
+        interaction is reused between steps, see knn_center_of_mass. The default is k_neighbours.
+    integrator : str, optional
+        "verlet" steps of unit length, or "adaptive" steps of length dt with substeps for the
+        agents under strong forces (max_displacement, max_substeps), see update_adaptive.
+        The default is "verlet".
+    trajectory_file : str, optional
+        without inline plotting, stream every stride-th step to this .npy file instead of
+        keeping all positions in memory. The default is None.
+    render_every : int, optional
+        with inline plotting, draw every render_every-th step. The default is 1.
+    max_fps : float, optional
+        with inline plotting, draw at most max_fps frames per second and skip the steps
+        in between. The default is 30.
+    backend : str, optional
+        "numpy" or "numba" (compiled step kernel, parallel over the agents). Falls back to
+        numpy when numba is not installed. The default is "numpy".
+    dtype : data type, optional
+        precision of the agent state, np.float32 halves the memory traffic. The default is np.float64.
+    checkpoint_file : str, optional
+        write a checkpoint every checkpoint_every steps, continue it with resume_simulation.
+        The default is None.
+    checkpoint_every : int, optional
+        The default is 1000.
 
     Returns
     -------
-    None.
+    positions : array (steps+1, n, d)
+        without inline plotting, a memory map of trajectory_file if it is given.
 
     '''
-    # use an interactive backend
-    matplotlib.use('Qt5Agg') # or 'Qt5Agg' or 'WXAgg'
+    # return positions for saving, the headless engine creates no figure
+    if not inline_plotting:
+        return run_simulation(mode = mode, d = d, param = param, trajectory_file = trajectory_file, stride = stride,
+                              backend = backend, dtype = dtype, checkpoint_file = checkpoint_file,
+                              checkpoint_every = checkpoint_every)
     
-    steps = param["steps"]
-    n = param["n"]
     param["d"] = d
+    if d not in (2, 3):
+        raise ValueError("Please simulate in 2 or 3 dimensions to plot inline!")
     
+    # use an interactive backend
+    matplotlib.use('Qt5Agg') # or 'Qt5Agg' or 'WXAgg'
+    fig, ax = initialize_figure(param)
     
+    # inline plotting to explore, the renderer is called after every step
+    renderer = LiveRenderer(fig, ax, param, predator = mode == "predator",
+                            render_every = render_every, max_fps = max_fps)
+    run_simulation(mode = mode, d = d, param = param, observers = [renderer], store_positions = False,
+                   backend = backend, dtype = dtype, checkpoint_file = checkpoint_file,
+                   checkpoint_every = checkpoint_every)
     
+    # close the plotting window
+    plt.close()
     
-    if mode == "basic": 
-        inline_plot_2D = inline_plot_2D_basic
-        inline_plot_3D = inline_plot_3D_basic
-        initialize_func = initialize_random
-        update_func = update
-    elif mode == "predator": 
-        inline_plot_2D = inline_plot_2D_predator
-        # inline_plot_3D = inline_plot_3D_basic
-        initialize_func = initialize_predator
-        update_func = update_predator
-        
-    agent_old, agent_now, fig, ax, param = initialize_func(param)
-        
-    # inline plotting to explore
-    if inline_plotting:
-        if d == 2: 
-            inline_plotting_func = inline_plot_2D
-        elif d == 3: 
-            inline_plotting_func = inline_plot_3D
-        else:
-            raise ValueError("Please simulate in 2 or 3 dimensions to plot inline!")
-        
-        # simulate
-        for i in range(steps):
-        
-            # print(param)
-            agent_temp, agent_plot, param = update_func(agent_now, agent_old, param)
-            # store updated and this position for next acceleration
-            agent_old = agent_now.copy()
-            agent_now = agent_temp.copy()
-            
-            # plot
-            inline_plotting_func(agent_plot, ax, param)
-        
-        # close the plotting window
-        plt.close()
-    
-    # return animation for saving
-    else:
-        plt.close()
-        # storage
-        positions = np.zeros((steps+1, n, d))
-        positions[0, :, :] = agent_now.copy()
-        
-        for i in range(steps):
-        
-        
-            agent_temp, agent_plot = update_func(agent_now, agent_old, param)
-            # store updated and this position for next acceleration
-            agent_old = agent_now.copy()
-            agent_now = agent_temp.copy()
-            
-            # insert in storage
-            positions[i+1, :, :] = agent_plot.copy()
-            
-        return positions
-    
-def animate_simulations(simulation_list, titles, filename, ax_lims = 50, pointsize = 2, directory = "animations"):
-    # use non-GUI backend
-    matplotlib.use('Agg')
-    
-    if not all(len(x) == len(simulation_list[0]) for x in simulation_list):
-        raise RuntimeError("All simulation must have been simulated with same number of steps")
-        
-    
+def animate_simulations(simulation_list, titles, filename, ax_lims = 50, pointsize = 2, directory = "animations",
+                        workers = None, fps = 20):
+    '''
+    Animates simulations side by side and saves them as mp4. Frames are read on demand, such
+    that trajectory files larger than the memory can be animated, and rendered in parallel
+    by worker processes that feed a single ffmpeg pipe, see flocking_render.render_video.
+
+    Parameters
+    ----------
+    simulation_list : list
+        arrays (steps+1, n, d), memory maps or filenames of stored trajectories.
+    titles : list of str
+    filename : str
+        name of the mp4 file, without extension.
+    workers : int, optional
+        number of rendering processes. The default is None (all cores).
+    fps : float, optional
+        frames per second of the video. The default is 20.
+
+    '''
     # check if directory exists
     if not os.path.exists(directory):
         # create directory if it does not exist
         os.makedirs(directory)
-        
-    
-    # extraxt dimension    
-    d = simulation_list[0].shape[2]
-    
-    if d == 2:
 
-        # Create a list of plot objects
-        lines = []
-        ncol = len(simulation_list)
-        fig, axs = plt.subplots(nrows=1, ncols=ncol, figsize = (ncol * 6,6))
-    
-        # distinguish between single and multi plotting
-        if ncol == 1:
-            # create PathCollection
-            line = axs.scatter([], [], s = pointsize)
-            axs.set_title = titles[0]
-            axs.set_xlim([-ax_lims, ax_lims])
-            axs.set_ylim([-ax_lims, ax_lims])
-    
-            def update(frame):
-                # reformat data
-                xy = np.column_stack(tup=(simulation_list[0][frame, :, 0], simulation_list[0][frame, :, 1]))
-                line.set_offsets(xy)
-                return (line,)
-    
-        else:
-            # for row in axs
-            for i, ax in enumerate(axs):
-                line = ax.scatter([], [], s = pointsize)
-                ax.set_title(titles[i])
-                ax.set_xlim([-ax_lims, ax_lims])
-                ax.set_ylim([-ax_lims, ax_lims])
-                lines.append(line)
-    
-            # define the animation function
-            def update(frame):
-                for i, line in enumerate(lines):
-                    # reformat data
-                    xy = np.column_stack(tup=(simulation_list[i][frame, :, 0], simulation_list[i][frame, :, 1]))
-                    line.set_offsets(xy)
-                return tuple(lines)
-    
-        anim = FuncAnimation(
-            fig=fig,
-            func=update,
-            frames=len(simulation_list[0]),
-            interval=50,
-            blit=True,
-        )
-    
-        anim.save(directory + "/" + filename + ".mp4")
-        
-    elif d == 3:
-
-        # create a list of plot objects
-        lines = []
-        ncol = len(simulation_list)
-        fig = plt.figure(figsize=(ncol*6, 6))
-        axs = [fig.add_subplot(1, ncol, i+1, projection='3d') for i in range(ncol)]
-    
-        if ncol == 1:
-            line = axs.scatter([], [], [], s = pointsize)
-            axs.set_title(titles[0])
-            axs.set_xlim3d([-ax_lims, ax_lims])
-            axs.set_ylim3d([-ax_lims, ax_lims])
-            axs.set_zlim3d([-ax_lims, ax_lims])
-    
-            def update(frame):
-                xyz = simulation_list[0][frame]
-                line._offsets3d = (xyz[:,0], xyz[:,1], xyz[:,2])
-                return (line,)
-    
-        else:
-            # for row in axs
-            for i, ax in enumerate(axs):
-                line = ax.scatter([], [], [], s = pointsize)
-                ax.set_title(titles[i])
-                ax.set_xlim3d([-ax_lims, ax_lims])
-                ax.set_ylim3d([-ax_lims, ax_lims])
-                ax.set_zlim3d([-ax_lims, ax_lims])
-                lines.append(line)
-    
-            # define the animation function
-            def update(frame):
-                for i, line in enumerate(lines):
-                    xyz = simulation_list[i][frame]
-                    line._offsets3d = (xyz[:,0], xyz[:,1], xyz[:,2])
-                return tuple(lines)
-    
-        anim = FuncAnimation(
-            fig=fig,
-            func=update,
-            frames=len(simulation_list[0]),
-            interval=50,
-            blit=True,
-        )
-    
-        anim.save(directory + "/" + filename + ".mp4")
+    # every worker draws on its own Agg canvas, no GUI backend is needed
+    render_video(simulation_list, titles, directory + "/" + filename + ".mp4", ax_lims = ax_lims,
+                 pointsize = pointsize, fps = fps, workers = workers)
 
 
         
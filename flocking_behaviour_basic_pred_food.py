@@ -1,16 +1,66 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
+from flocking_engine import (initialize_agents, update_forces, run_simulation, CenterPull, ChasingPredators,
+                             FoodPull)
 
 
-def initialize_random(param, pred=False, food=False):
+def make_forces(pred=False, food=False):
+    '''
+    Force terms of the simulation, registered once for all steps. The predators chase the flock
+    and push with the third power of the distance, without predator the food term is sharpened.
+
+    Returns
+    -------
+    forces : list of ForceTerm
+
+    '''
+    forces = [CenterPull()]
+    if pred:
+        forces.append(ChasingPredators(power=3))
+    if food:
+        forces.append(FoodPull(exponent=None if pred else 13))
+    return forces
+
+def initialize_figure(param):
+    '''
+    Creates the plotting window, twice as large as the box because the agents are not wrapped
+    '''
+    d = param["d"]
+    lower_lim, upper_lim = param["ax_lim"]
+    lower_lim, upper_lim = 2*lower_lim, 2*upper_lim
+    if d == 2: 
+        # some fig to plot
+        fig = plt.figure()
+        ax = fig.add_subplot(1, 1, 1)
+        ax.set_xlim(lower_lim, upper_lim)
+        ax.set_ylim(lower_lim, upper_lim)
+    elif d == 3: 
+        fig = plt.figure()
+        ax = fig.add_subplot(1, 1, 1, projection = "3d")
+        ax.set_xlim(lower_lim, upper_lim)
+        ax.set_ylim(lower_lim, upper_lim)
+        ax.set_zlim(lower_lim, upper_lim)
+    else:
+        raise ValueError("Incorrect number of dimensions. Choose d=2 or d=3.")
+    return fig, ax
+
+def initialize_random(param, pred=False, food=False, dtype=np.float64, forces=None, rng=None):
     '''
     This function initializes the agents, as well as the plotting window
 
     Parameters
     ----------
     param : dict
-        Holds the necessary parameters.
+        Holds the necessary parameters, n_predators and n_food (default 1) set the number
+        of predators and food sources.
+    dtype : data type, optional
+        dtype of the agents, the predator and the food. The default is np.float64.
+    forces : list of ForceTerm, optional
+        terms that place their agents, the default is make_forces(pred, food).
+    rng : np.random.Generator, optional
+        random stream of the initial state, e.g. np.random.default_rng(18) for the same start
+        in every run. The default is None (global numpy random state).
 
     Raises
     ------
@@ -23,54 +73,28 @@ def initialize_random(param, pred=False, food=False):
         Zeros.
     agent_now : np.ndarray
         Initial positions of agents.
-    double_agent: np array, initial position of predator
+    double_agent: np array (n_predators, d), initial position of predators
+    food_coord: np array (n_food, d), position of food sources
     fig : figure object
         Figure to plot in.
     ax : artist object
         Artist axis to plot in.
 
     '''
-    n = param["n"]
-    d = param["d"]
-    ax_low, ax_high = param["ax_lim"]
-    low, high = param["init_coord"]
-    lower_lim, upper_lim = param["ax_lim"]
-    lower_lim, upper_lim = 2*lower_lim, 2*upper_lim
-
-    # initialize n agents in d dimensions
-    
-    np.random.seed(18)
-    agent_now = np.random.uniform(low=low, high=high, size=(n, d))
-    agent_old = np.zeros_like(agent_now)
-    agent_temp = np.zeros_like(agent_now)
-    if pred:
-        double_agent_now = np.random.uniform(low=low-10,high=high-10, size=(1,d))  #start predator off in lower corner
-        double_agent_old = np.random.uniform(low=low-10,high=high-10, size=(1,d))  #start predator off in lower corner
-    if food: 
-        food_coord = np.random.uniform(ax_low, ax_high, size=(1,d))
-    if d == 2: 
-        # some fig to plot
-        fig = plt.figure()
-        ax = fig.add_subplot(1, 1, 1)
-        ax.set_xlim(lower_lim, upper_lim)
-        ax.set_ylim(lower_lim, upper_lim)
-    elif d == 3: 
-        fig = plt.figure()
-        ax = fig.add_subplot(1, 1, 1, projection = "3d")
-        ax.set_xlim(lower_lim, upper_lim)
-        ax.set_ylim(lower_lim, upper_lim)
-        ax.set_zlim(lower_lim, upper_lim)
-    else:
-        raise ValueError("Incorrect number of dimensions. Choose d=2 or d=3.")
+    # initialize n agents in d dimensions, the predators and the food
+    agent_old, agent_now, param = initialize_agents(param, dtype=dtype, rng=rng)
+    for term in make_forces(pred, food) if forces is None else forces:
+        term.initialize(param, dtype, rng)
+    fig, ax = initialize_figure(param)
     if pred and food:
-        return agent_old, agent_now, fig, ax, double_agent_now, double_agent_old, food_coord
+        return agent_old, agent_now, fig, ax, param["predator_xy"], param["predator_old"], param["food_xy"]
     if pred:
-        return agent_old, agent_now, fig, ax, double_agent_now, double_agent_old
+        return agent_old, agent_now, fig, ax, param["predator_xy"], param["predator_old"]
     if food:
-        return agent_old, agent_now, fig, ax, food_coord
+        return agent_old, agent_now, fig, ax, param["food_xy"]
     return agent_old, agent_now, fig, ax
 
-def inline_plot_2D(agent_now, ax, param,double_agent_now='not here', food_coord='not here'):
+def inline_plot_2D(agent_now, ax, param, double_agent_now=None, food_coord=None):
     '''
     Plots in 2D after clearing axis object
 
@@ -88,20 +112,17 @@ def inline_plot_2D(agent_now, ax, param,double_agent_now='not here', food_coord=
     # plot 2D
     ax.clear()
     ax.scatter(agent_now[:, 0], agent_now[:, 1])
-    if (type(double_agent_now)!=str) and (type(food_coord)!=str):
-        ax.scatter(double_agent_now[0,0],double_agent_now[0,1],marker='D',s=100)
-        ax.scatter(food_coord[0,0],food_coord[0,1],marker='*',s=100)
-    if (type(double_agent_now)!=str):
-        ax.scatter(double_agent_now[0,0],double_agent_now[0,1],marker='D',s=100)
-    if (type(food_coord)!=str):
-        ax.scatter(food_coord[0,0],food_coord[0,1],marker='*',s=100)
+    if double_agent_now is not None:
+        ax.scatter(double_agent_now[:,0],double_agent_now[:,1],marker='D',s=100)
+    if food_coord is not None:
+        ax.scatter(food_coord[:,0],food_coord[:,1],marker='*',s=100)
     ax.set_xlim(lower_lim, upper_lim)
     ax.set_ylim(lower_lim, upper_lim)
     plt.pause(0.01)
     return ax
     
 
-def inline_plot_3D(agent_now, ax, param,double_agent_now='not here', food_coord='not here'):
+def inline_plot_3D(agent_now, ax, param, double_agent_now=None, food_coord=None):
     '''
     Plots in 3D after clearing axis object
 
@@ -117,13 +138,10 @@ def inline_plot_3D(agent_now, ax, param,double_agent_now='not here', food_coord=
     '''
     lower_lim, upper_lim = param["ax_lim"]
     ax.clear()
-    if (type(double_agent_now)!=str) and (type(food_coord)!=str):
-        ax.scatter(double_agent_now[0,0],double_agent_now[0,1],double_agent_now[0, 2],marker='D',s=50)
-        ax.scatter(food_coord[0,0],food_coord[0,1],food_coord[0, 2],marker='*',s=50)
-    if (type(double_agent_now)!=str):
-        ax.scatter(double_agent_now[0,0],double_agent_now[0,1],double_agent_now[0, 2],marker='D',s=50)
-    if (type(food_coord)!=str):
-        ax.scatter(food_coord[0,0],food_coord[0,1],food_coord[0, 2],marker='*',s=50)
+    if double_agent_now is not None:
+        ax.scatter(double_agent_now[:,0],double_agent_now[:,1],double_agent_now[:, 2],marker='D',s=50)
+    if food_coord is not None:
+        ax.scatter(food_coord[:,0],food_coord[:,1],food_coord[:, 2],marker='*',s=50)
     ax.scatter(agent_now[:, 0], agent_now[:, 1], agent_now[:, 2])
     ax.set_xlim(lower_lim, upper_lim)
     ax.set_ylim(lower_lim, upper_lim)
@@ -131,92 +149,65 @@ def inline_plot_3D(agent_now, ax, param,double_agent_now='not here', food_coord=
     plt.pause(0.01)
     return ax
 
-def euclidian_dist(array):
-
-    return np.sqrt(np.sum(array**2, axis = 1))
-
-def update(agent_now, agent_old, param, double_agent_now='not here', double_agent_old=None, food_coord='not here'):
+def update(agent_now, agent_old, param, double_agent_now=None, double_agent_old=None, food_coord=None, buffers=None,
+           forces=None):
     '''
     Update of the postion of the agents, with the assumption that their acceleretion is computed from
-    their pull towards the center of mass and the delta between their new and old position
+    their pull towards the center of mass and the delta between their new and old position. Single
+    steps with the force terms of make_forces, simulate_flocking registers them once instead.
     Parameters
     ----------
     agent_now : array (n, d)
         DESCRIPTION.
     agent_old : array (n, d)
         DESCRIPTION.
-    double_agent_old : array (1,d) (or None)
-        DESCRIPTION.
-    double_agent_now : array (1,d) (or string not here)
-        DESCRIPTION.
+    double_agent_old : array (M,d) (or None)
+        positions of the M predators in the last step.
+    double_agent_now : array (M,d) (or None)
+        positions of the M predators.
     center_pull : int, optional
         DESCRIPTION. The default is 1.5.
     predator_pull : int, optional
         Description. The default is 1.5
     predator_push : int, optional
         Description. The default is -1.5
-    food_coord : array(1,d) (or string not here)
-        Description. 
+    food_coord : array(F,d) (or None)
+        positions of the F food sources.
     food_pull : int, optional
         Description. The default is 1.5
+    buffers : dict, optional
+        preallocated arrays from allocate_buffers, agent_temp is written into them.
+    forces : list of ForceTerm, optional
+        force terms of the step. The default is make_forces(pred, food).
     Returns
     -------
     agent_temp : updated positon of agents
-    optional :  double_agent_now, updated position of double agent
+    optional :  double_agent_now, updated position of the predators
     '''
-    d = param["d"]
-    center_pull = param["center_pull"]
-
-    agent_temp = np.zeros_like(agent_now)
-    double_agent_temp = np.zeros_like(double_agent_now)
-    # calculate center of mass
-    C = np.mean(agent_now, axis=0)
-    if (type(food_coord) != str):
-        food_pull = param["food_pull"]
-    if (type(double_agent_now) != str):
-        predator_pull = param["predator_pull"]
-        predator_push = param["predator_push"]
-        double_agent_temp = np.zeros_like(double_agent_now)
-        n=len(agent_old)
-        predator_position = np.tile(double_agent_old, (n, 1)) #old because assume the bird's reaction times are delayed
-
-    # update the agent position according to acceleration to center
-    for j in range(d):
-        if (type(food_coord) == str) and (type(double_agent_now) == str):
-            agent_temp[:, j] = 2 * agent_now[:, j] - agent_old[:, j] + \
-            center_pull * (C[j] - agent_now[:, j]) / euclidian_dist((C - agent_now))
-        if (type(food_coord) == str) and (type(double_agent_now) != str):
-            agent_temp[:,j] = 2 * agent_now[:, j] - agent_old[:, j] + \
-            center_pull * (C[j] - agent_now[:, j]) / euclidian_dist((C - agent_now)) +\
-            predator_push * (predator_position[:,j]-agent_now[:,j]) / euclidian_dist((double_agent_old-agent_now))**3
-            double_agent_temp[0,j] = 2 * double_agent_now[0,j] - double_agent_old[0,j] + \
-            predator_pull * (C[j] - double_agent_now[0,j]) / euclidian_dist((C - double_agent_now))
-            #note that C is calculated from last iteration, showing reaction time of predator also not 0
-        if (type(double_agent_now) == str and type(food_coord) != str):
-            agent_temp[:,j] = 2 * agent_now[:, j] - agent_old[:, j] + \
-            center_pull * (C[j] - agent_now[:, j]) / euclidian_dist((C - agent_now)) +\
-            (-food_pull) * abs((((C[j])-(food_coord[0,j]))/abs(euclidian_dist((C - food_coord))))**(13))
-        if (type(double_agent_now) != str and type(food_coord) != str):
-            agent_temp[:,j] = 2 * agent_now[:, j] - agent_old[:, j] + \
-            center_pull * (C[j] - agent_now[:, j]) / euclidian_dist((C - agent_now)) +\
-            predator_push * (predator_position[:,j]-agent_now[:,j]) / euclidian_dist((double_agent_old-agent_now))**3+\
-            (-food_pull) * (C[j] - food_coord[0,j]) / euclidian_dist((C - food_coord))
-            double_agent_temp[0,j] = 2 * double_agent_now[0,j] - double_agent_old[0,j] + \
-            predator_pull * (C[j] - double_agent_now[0,j]) / euclidian_dist((C - double_agent_now))
-    if (type(double_agent_now) != str):
-        return agent_temp, double_agent_temp
+    pred = double_agent_now is not None
+    if pred:
+        # the predators are moved in place, the arrays of the caller are kept
+        param["predator_xy"] = double_agent_now.copy()
+        param["predator_old"] = double_agent_old.copy()
+    if food_coord is not None:
+        param["food_xy"] = food_coord
+    param.setdefault("periodic", False)
+    if forces is None:
+        forces = make_forces(pred, food_coord is not None)
+    agent_temp, agent_plot, param = update_forces(agent_now, agent_old, param, forces, buffers)
+    if pred:
+        return agent_temp, param["predator_xy"]
     return agent_temp
     
 
-def simulate_flocking(initialize_func = initialize_random,
-                      update_func = update,
-                      inline_plotting = True,
+def simulate_flocking(inline_plotting = True,
                       d = 2,
                       param = {"n" : 100,
                                "init_coord":(-1, 1),
                                "ax_lim": (-50, 50),
                                "steps": 100,
-                               "center_pull": 1.5,"predator_pull": 1.5,"predator_push": -0.5, "food_pull": -0.1}, pred=False, food=False):
+                               "center_pull": 1.5,"predator_pull": 1.5,"predator_push": -0.5, "food_pull": -0.1}, pred=False, food=False, dtype=np.float64,
+                      forces=None, backend="numpy", rng=None):
     '''
 
     Parameters
@@ -233,94 +224,51 @@ def simulate_flocking(initialize_func = initialize_random,
         pull factor for predator towards center of mass of birds. The default is 1.5
     predator_push : int, optional
         push factor for predator towards center of mass of birds. The default is -1.5
+    dtype : data type, optional
+        precision of the simulation state and the stored positions. The default is np.float64.
+    forces : list of ForceTerm, optional
+        force terms of the simulation. The default is make_forces(pred, food).
+    rng : np.random.Generator, optional
+        random stream of the initial state, e.g. np.random.default_rng(18) for the same start
+        in every run. The default is None (global numpy random state).
 
     Returns
     -------
-    None.
+    positions : array (steps+1, n, d)
+        without inline plotting.
 
     '''
-    steps = param["steps"]
-    n = param["n"]
     param["d"] = d
+    # the agents are not wrapped into the box
+    param.setdefault("periodic", False)
+    forces = make_forces(pred, food) if forces is None else forces
+    if not inline_plotting:
+        return run_simulation(d=d, param=param, forces=forces, dtype=dtype, backend=backend, rng=rng)
 
-    if pred and food:
-        agent_old, agent_now, fig, ax, double_agent_now, double_agent_old, food_coord= initialize_func(param, pred=True, food=True)
-    elif pred:
-        agent_old, agent_now, fig, ax, double_agent_now, double_agent_old= initialize_func(param, pred=True)
-    elif food:
-        agent_old, agent_now, fig, ax, food_coord= initialize_func(param, food=True)
+    if d == 2: 
+        inline_plotting_func = inline_plot_2D
+    elif d == 3: 
+        inline_plotting_func = inline_plot_3D
     else:
-        agent_old, agent_now, fig, ax = initialize_func(param)
-    
-    # inline plotting to explore
-    if inline_plotting:
-        if d == 2: 
-            inline_plotting_func = inline_plot_2D
-        elif d == 3: 
-            inline_plotting_func = inline_plot_3D
-        else:
-            raise ValueError("Please simulate in 2 or 3 dimensions to plot inline!")
-        
-        # simulate
-        for i in range(steps):
-            if pred and food:
-                agent_temp, double_agent_temp = update_func(agent_now,agent_old,param,double_agent_now,double_agent_old, food_coord)
-                double_agent_old = double_agent_now.copy()
-                double_agent_now = double_agent_temp.copy()
-                agent_old = agent_now.copy()
-                agent_now = agent_temp.copy()
-                inline_plotting_func(agent_now, ax, param, double_agent_now, food_coord)
-            elif pred:
-                agent_temp, double_agent_temp = update_func(agent_now,agent_old,param,double_agent_now,double_agent_old)
-                double_agent_old = double_agent_now.copy()
-                double_agent_now = double_agent_temp.copy()
-                agent_old = agent_now.copy()
-                agent_now = agent_temp.copy()
-                inline_plotting_func(agent_now, ax, param, double_agent_now)
-            elif food:
-                agent_temp = update_func(agent_now, agent_old, param, food_coord=food_coord)
-                agent_old = agent_now.copy()
-                agent_now = agent_temp.copy()
-                # store updated and this position for next acceleration
-                # plot
-                inline_plotting_func(agent_now, ax, param, food_coord)
-            else:
-                agent_temp = update_func(agent_now, agent_old, param)
-                agent_old = agent_now.copy()
-                agent_now = agent_temp.copy()
-                # store updated and this position for next acceleration
-                # plot
-                inline_plotting_func(agent_now, ax, param)
-        
-        # close the plotting window
-        plt.close()
+        raise ValueError("Please simulate in 2 or 3 dimensions to plot inline!")
+    fig, ax = initialize_figure(param)
+
+    def observer(i, agent_plot, param):
+        inline_plotting_func(agent_plot, ax, param, param.get("predator_xy"), param.get("food_xy"))
+
+    # simulate, one engine step for every combination of predators and food
+    run_simulation(d=d, param=param, forces=forces, dtype=dtype, backend=backend, store_positions=False,
+                   observers=[observer], rng=rng)
     
-    # return animation for saving
-    else:
-        plt.close()
-        # storage
-        positions = np.zeros((steps+1, n, d))
-        positions[0, :, :] = agent_now.copy()
-        
-        for i in range(steps):
-        
-        
-            agent_temp = update_func(agent_now, agent_old, param)
-            # store updated and this position for next acceleration
-            agent_old = agent_now.copy()
-            agent_now = agent_temp.copy()
-            
-            # insert in storage
-            positions[i+1, :, :] = agent_now.copy()
-            
-        return positions
+    # close the plotting window
+    plt.close()
             
     
     
         
 if __name__ == "__main__":
     # simulate in 2D
-    simulate_flocking(d = 2, pred=True, food=True,param = {"n" : 100,
+    simulate_flocking(d = 2, pred=True, food=True, rng=np.random.default_rng(18), param = {"n" : 100,
                                 "init_coord":(-1, 1),
 
                                 "ax_lim": (-100, 100),
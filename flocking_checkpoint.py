@@ -0,0 +1,106 @@
+import os
+import json
+import tempfile
+import numpy as np
+
+
+def split_arrays(values, prefix):
+    '''
+    Splits a dict into its arrays, stored under prefix + key, and the json serialisable rest.
+    Nested dicts of arrays (like the knn state) are split recursively.
+    '''
+    arrays = {}
+    rest = {}
+    for key, value in values.items():
+        if isinstance(value, np.ndarray):
+            arrays[prefix + key] = value
+        elif isinstance(value, dict):
+            nested_arrays, nested_rest = split_arrays(value, prefix + key + ".")
+            arrays.update(nested_arrays)
+            rest[key] = nested_rest
+        elif isinstance(value, np.generic):
+            rest[key] = value.item()
+        else:
+            rest[key] = value
+
+    return arrays, rest
+
+def join_arrays(rest, arrays, prefix):
+    '''
+    Inverse of split_arrays
+    '''
+    values = {}
+    for key, value in rest.items():
+        values[key] = join_arrays(value, arrays, prefix + key + ".") if isinstance(value, dict) else value
+    for name, array in arrays.items():
+        if name.startswith(prefix) and "." not in name[len(prefix):]:
+            values[name[len(prefix):]] = array
+
+    return values
+
+def save_checkpoint(filename, state):
+    '''
+    Writes the state of a simulation to a binary .npz file. The file is written next to its
+    destination and then renamed, such that a crash during writing keeps the last checkpoint.
+
+    Parameters
+    ----------
+    filename : str
+        checkpoint file.
+    state : dict
+        step, agent_now, agent_old, param, config (arguments of run_simulation) and the random
+        stream of the run: rng (np.random.Generator) or, for runs on the global random state,
+        rng_state (np.random.get_state()).
+
+    '''
+    param_arrays, param_rest = split_arrays(state["param"], "param.")
+    header = {"param": param_rest, "config": state["config"]}
+    if state.get("rng") is not None:
+        # the bit generator state, e.g. the 128 bit integers of PCG64, json keeps them exactly
+        rng_arrays, header["rng"] = split_arrays(state["rng"].bit_generator.state, "rng.")
+    else:
+        rng_name, rng_keys, rng_pos, rng_has_gauss, rng_gauss = state["rng_state"]
+        rng_arrays = {"rng_keys": rng_keys}
+        header.update({"rng_name": rng_name, "rng_pos": int(rng_pos), "rng_has_gauss": int(rng_has_gauss),
+                       "rng_gauss": float(rng_gauss)})
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    file_descriptor, temp_filename = tempfile.mkstemp(dir = directory, suffix = ".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            np.savez(file, step = state["step"], agent_now = state["agent_now"], agent_old = state["agent_old"],
+                     header = np.array(json.dumps(header)), **rng_arrays, **param_arrays)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+def load_checkpoint(filename):
+    '''
+    Reads a checkpoint of save_checkpoint
+
+    Returns
+    -------
+    state : dict
+        as passed to save_checkpoint.
+
+    '''
+    with np.load(filename) as data:
+        header = json.loads(str(data["header"]))
+        arrays = {name: data[name] for name in data.files if name.startswith(("param.", "rng."))}
+        state = {"step": int(data["step"]), "agent_now": data["agent_now"], "agent_old": data["agent_old"],
+                 "rng": None, "rng_state": None}
+        if "rng" in header:
+            rng_state = join_arrays(header["rng"], arrays, "rng.")
+            bit_generator = getattr(np.random, rng_state["bit_generator"])()
+            bit_generator.state = rng_state
+            state["rng"] = np.random.Generator(bit_generator)
+        else:
+            state["rng_state"] = (header["rng_name"], data["rng_keys"], header["rng_pos"],
+                                  header["rng_has_gauss"], header["rng_gauss"])
+    state["param"] = join_arrays(header["param"], arrays, "param.")
+    state["config"] = header["config"]
+
+    return state
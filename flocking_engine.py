@@ -0,0 +1,958 @@
+import warnings
+import numpy as np
+from flocking_neighbours import local_center_of_mass, knn_center_of_mass, wrap_into_box
+from flocking_trajectory import TrajectoryWriter, DeltaTrajectoryWriter, AsyncTrajectoryWriter, open_trajectory
+from flocking_checkpoint import save_checkpoint, load_checkpoint
+from flocking_init import initial_positions, as_generator
+
+
+def initialize_agents(param, predator = False, dtype = np.float64, rng = None):
+    '''
+    This function initializes the agents (and the predator), without any plotting
+
+    Parameters
+    ----------
+    param : dict
+        Holds the necessary parameters, param["init"] chooses the initializer, see
+        flocking_init.initial_positions.
+    predator : bool, optional
+        place the predator in param["predator_xy"], as (d,) array or, if param["n_predators"]
+        is given, as (n_predators, d) array. The default is False.
+    dtype : data type, optional
+        dtype of the agent and predator state. The default is np.float64.
+    rng : np.random.Generator, optional
+        random stream of the initial state. The default is None (global numpy random state).
+
+    Raises
+    ------
+    ValueError
+        Dimension is not supplied or invalid.
+
+    Returns
+    -------
+    agent_old : np.ndarray
+        Zeros, such that the first step moves every agent by its initial position. With the
+        adaptive integrator agent_now * (1 - dt), the same velocity per unit time.
+    agent_now : np.ndarray
+        Initial positions of agents.
+
+    '''
+    d = param["d"]
+    if d not in (2, 3):
+        raise ValueError("Incorrect number of dimensions. Choose d=2 or d=3.")
+
+    # initialize n agents in d dimensions
+    agent_now = initial_positions(param, rng).astype(dtype, copy = False)
+    dt = time_step(param)
+    agent_old = np.zeros_like(agent_now) if dt == 1 else agent_now * (1 - dt)
+    if predator:
+        PredatorPush().initialize(param, dtype, rng)
+
+    return agent_old, agent_now, param
+
+def euclidian_dist(array, axis):
+
+    return np.sqrt(np.sum(array**2, axis = axis))
+
+def time_step(param):
+    '''
+    Length of a step, param["dt"] (default 1) for the adaptive integrator, plain Verlet steps
+    have unit length
+    '''
+    return param.get("dt", 1.0) if param.get("integrator", "verlet") == "adaptive" else 1.0
+
+def allocate_buffers(n, d, dtype = np.float64, replicates = None):
+    '''
+    Preallocates the work arrays of the step kernel, such that a simulation does not
+    allocate new arrays on every step
+
+    Parameters
+    ----------
+    n : int
+        number of agents.
+    d : int
+        number of dimensions.
+    dtype : data type, optional
+        The default is np.float64.
+    replicates : int, optional
+        number of flocks simulated at once, adds a leading axis to all buffers. The default is None.
+
+    Returns
+    -------
+    buffers : dict
+        agent_temp and agent_plot (n, d) hold the outputs, diff (n, d) and dist (n,)
+        are scratch space for the force terms. dist_center (n,) keeps the distance of every
+        agent to its center of mass, the step kernels add C and, with a predator,
+        dist_predator for the metrics of the step. The engine adds wrap, see needs_wrap.
+
+    '''
+    batch = () if replicates is None else (replicates,)
+
+    return {"agent_temp": np.empty(batch + (n, d), dtype = dtype),
+            "agent_plot": np.empty(batch + (n, d), dtype = dtype),
+            "diff": np.empty(batch + (n, d), dtype = dtype),
+            "dist": np.empty(batch + (n,), dtype = dtype),
+            "dist_center": np.empty(batch + (n,), dtype = dtype)}
+
+class StateRing:
+    '''
+    The positions of the last, the current and the next step in three preallocated buffers.
+    The step kernel writes the next positions into buffers["agent_temp"], which is the free
+    buffer of the ring; rotate() then passes the roles on by swapping references, such that
+    no positions are copied between the steps.
+
+    Parameters
+    ----------
+    agent_now : array (..., n, d)
+    agent_old : array (..., n, d)
+        positions of the first step, they are copied into the ring.
+    buffers : dict
+        work arrays from allocate_buffers, agent_temp is the third buffer of the ring.
+
+    '''
+    def __init__(self, agent_now, agent_old, buffers):
+        self.buffers = buffers
+        self.now = np.array(agent_now, dtype = buffers["agent_temp"].dtype)
+        self.old = np.array(agent_old, dtype = buffers["agent_temp"].dtype)
+
+    def rotate(self):
+        '''
+        The next positions become the current ones, the current ones the last ones, and the
+        buffer of the last ones is handed to the kernel for the next step
+        '''
+        free = self.old
+        self.old = self.now
+        self.now = self.buffers["agent_temp"]
+        self.buffers["agent_temp"] = free
+
+def verlet_step(agent_now, agent_old, out):
+    '''
+    Writes the force free position-Verlet step 2 * agent_now - agent_old into out
+    '''
+    np.multiply(agent_now, 2, out = out)
+    np.subtract(out, agent_old, out = out)
+    
+    return out
+
+def add_pull(out, target, agent_now, strength, buffers, power = 1, dist = None):
+    '''
+    Adds strength * (target - agent_now) / |target - agent_now|**power to out. The distance
+    of every agent to the target is computed once for all dimensions.
+
+    Parameters
+    ----------
+    out : array (n, d) or (B, n, d)
+        accumulated positions, modified in place.
+    target : array (d,) or (n, d), or with a leading replicate axis (B, 1, d) or (B, n, d)
+        point (or per agent points) the agents are pulled towards. Agents sitting on
+        their target feel no pull.
+    agent_now : array (n, d) or (B, n, d)
+    strength : float or array (B, 1)
+        pull factor, negative values push the agents away from the target.
+    buffers : dict
+        scratch space as returned by allocate_buffers.
+    power : int, optional
+        power of the distance in the denominator. The default is 1 (unit vector).
+    dist : array (n,) or (B, n), optional
+        array the distances are written into. The default is None (buffers["dist"]).
+
+    Returns
+    -------
+    dist : array (n,) or (B, n)
+        distance of every agent to the target (a view into the buffers).
+
+    '''
+    diff = buffers["diff"]
+    if dist is None:
+        dist = buffers["dist"]
+    np.subtract(target, agent_now, out = diff)
+    np.einsum("...j,...j->...", diff, diff, out = dist)
+    np.sqrt(dist, out = dist)
+    # scale factor per agent, such that the (n, d) array is only touched twice
+    scale = np.power(dist, power)
+    # scale stays zero where the agent sits on its target
+    np.divide(strength, scale, out = scale, where = scale > 0)
+    diff *= scale[..., None]
+    out += diff
+    
+    return dist
+
+def add_pulls(out, targets, agent_now, strength, power = 1, dist = None, max_pairs = 2**20):
+    '''
+    Adds the pulls of M targets, the sum over m of strength * (targets[m] - agent_now) /
+    |targets[m] - agent_now|**power, to out. The (n, M) agent-target distances are broadcast
+    in chunks of agents, such that the temporary arrays stay small for many targets.
+
+    Parameters
+    ----------
+    out : array (n, d)
+        accumulated positions, modified in place.
+    targets : array (M, d)
+        points the agents are pulled towards, e.g. the predators.
+    agent_now : array (n, d)
+    strength : float
+        pull factor, negative values push the agents away from the targets.
+    power : int, optional
+        power of the distance in the denominator. The default is 1 (unit vectors).
+    dist : array (n,), optional
+        receives the distance of every agent to its nearest target. The default is None.
+    max_pairs : int, optional
+        largest number of agent-target pairs handled at once. The default is 2**20.
+
+    Returns
+    -------
+    dist : array (n,) or None
+
+    '''
+    n = len(agent_now)
+    M = len(targets)
+    if M == 0:
+        return dist
+    chunk = max(1, max_pairs // M)
+    for start in range(0, n, chunk):
+        stop = min(n, start + chunk)
+        # one contiguous (chunk, M) plane per dimension, faster to reduce than (chunk, M, d)
+        planes = [np.subtract.outer(agent_now[start:stop, j], targets[:, j]) for j in range(agent_now.shape[1])]
+        target_dist = np.zeros_like(planes[0])
+        for plane in planes:
+            target_dist += plane * plane
+        np.sqrt(target_dist, out = target_dist)
+        if dist is not None:
+            np.min(target_dist, axis = 1, out = dist[start:stop])
+        scale = np.power(target_dist, power, out = target_dist)
+        # targets an agent sits on do not pull, the planes point from the targets to the agents
+        np.divide(-strength, scale, out = scale, where = scale > 0)
+        for j, plane in enumerate(planes):
+            plane *= scale
+            out[start:stop, j] += np.sum(plane, axis = 1)
+
+    return dist
+
+def periodic_boundaries(agent_temp, param, out):
+    '''
+    Periodic boundary conditions, the unwrapped positions agent_temp are wrapped into the box
+    param["ax_lim"] and written into out, see flocking_neighbours.wrap_into_box
+    '''
+    return wrap_into_box(agent_temp, param["ax_lim"], out = out)
+
+def needs_wrap(param, buffers):
+    '''
+    Whether the step kernel wraps the positions of this step: the simulation is periodic
+    (param["periodic"], default True) and the frame is stored or drawn, which the engine
+    tells the kernel in buffers["wrap"] (default True). Otherwise agent_plot is agent_temp.
+    '''
+    return param.get("periodic", True) and buffers.get("wrap", True)
+
+def center_of_mass(agent_now, param):
+    '''
+    Center of mass the agents steer towards, depending on param["interaction"]
+
+    Parameters
+    ----------
+    agent_now : array (n, d)
+    param : dict
+        interaction "global" (default) uses the mean of the flock, "radius" the local center
+        of mass of the agents within param["neighbour_radius"] and "knn" the center of mass of
+        the param["k_neighbours"] nearest flockmates. The KD-tree of the knn interaction is
+        kept in param["knn_state"] between steps, with param["knn_extra"] candidates beyond
+        the k nearest (default k_neighbours), see knn_center_of_mass.
+
+    Returns
+    -------
+    C : array (d,) or (n, d)
+
+    '''
+    interaction = param.get("interaction", "global")
+    if interaction == "global":
+        # reductions are accumulated in float64, also for float32 agents
+        return np.mean(agent_now, axis=0, dtype=np.float64)
+    elif interaction == "radius":
+        C, n_neighbours = local_center_of_mass(agent_now, param["neighbour_radius"], param["ax_lim"])
+        return C
+    elif interaction == "knn":
+        return knn_center_of_mass(agent_now, param["k_neighbours"], param["ax_lim"],
+                                  param.setdefault("knn_state", {}), extra = param.get("knn_extra"))
+    else:
+        raise ValueError("Unknown interaction. Choose 'global', 'radius' or 'knn'.")
+
+class ForceTerm:
+    '''
+    Force term of the step kernel update_forces. A term adds its displacement to the new
+    positions in apply and moves its own agents (e.g. predators) in advance, after all terms
+    have been applied. The center of mass of the flock (C_flock) and the one the agents steer
+    to (C) are computed once per step and shared through the buffers. The state of a term
+    lives in param, such that checkpoints and trajectories keep it.
+    '''
+    # the term reads buffers["C_flock"], the mean of the whole flock
+    flock_center = False
+
+    def initialize(self, param, dtype = np.float64, rng = None):
+        '''
+        Places the agents of the term in param, after the flock is initialized, drawing from
+        rng (default: the global numpy random state)
+        '''
+
+    def apply(self, agent_temp, agent_now, param, buffers):
+        raise NotImplementedError
+
+    def advance(self, param, buffers):
+        '''
+        Moves the agents of the term, after the flock has been updated
+        '''
+
+    def config(self):
+        '''
+        json serialisable description of the term (its class and the arguments it was built
+        with), which checkpoints keep to rebuild it with forces_from_config
+        '''
+        return {"term": type(self).__name__, **vars(self)}
+
+class CenterPull(ForceTerm):
+    '''
+    Pull of param["center_pull"] towards the (global or local) center of mass, see center_of_mass
+    '''
+    def apply(self, agent_temp, agent_now, param, buffers):
+        add_pull(agent_temp, buffers["C"], agent_now, param["center_pull"], buffers, dist = buffers["dist_center"])
+
+class PredatorPush(ForceTerm):
+    '''
+    Push of param["predator_push"] from the predators in param["predator_xy"], (d,) or
+    (n_predators, d). After the step every predator is placed at distance param["predator_pull"]
+    from the origin, in the direction from the center of mass of the flock to the predator.
+    '''
+    flock_center = True
+
+    def initialize(self, param, dtype = np.float64, rng = None):
+        rng = np.random if rng is None else rng
+        lower_lim, upper_lim = param["ax_lim"]
+        n_predators = param.get("n_predators")
+        size = param["d"] if n_predators is None else (n_predators, param["d"])
+        param["predator_xy"] = rng.choice([lower_lim + 1, upper_lim - 1], size = size, replace = True).astype(dtype)
+
+    def apply(self, agent_temp, agent_now, param, buffers):
+        predator_xy = param["predator_xy"]
+        if "dist_predator" not in buffers:
+            buffers["dist_predator"] = np.empty_like(buffers["dist"])
+        if predator_xy.ndim == 1:
+            add_pull(agent_temp, predator_xy, agent_now, param["predator_push"], buffers, dist = buffers["dist_predator"])
+        else:
+            # several predators, dist_predator holds the distance to the nearest one
+            add_pulls(agent_temp, predator_xy, agent_now, param["predator_push"], dist = buffers["dist_predator"])
+
+    def advance(self, param, buffers):
+        # predators are placed at predator_pull from the origin, in their direction from the
+        # center of mass of this step
+        predator_xy = param["predator_xy"]
+        C = buffers["C_flock"]
+        predator_xy[:] = param["predator_pull"] * (predator_xy - C) / euclidian_dist((predator_xy - C), axis = -1)[..., None]
+
+class ChasingPredators(ForceTerm):
+    '''
+    Predators with their own position-Verlet step, param["predator_xy"] and param["predator_old"]
+    (n_predators, d), which accelerate by param["predator_pull"] towards the center of mass of
+    the flock. They push the agents by param["predator_push"] / distance**power, the agents
+    react to the positions of the predators in the last step.
+    '''
+    flock_center = True
+
+    def __init__(self, power = 3):
+        self.power = power
+
+    def initialize(self, param, dtype = np.float64, rng = None):
+        rng = np.random if rng is None else rng
+        low, high = param["init_coord"]
+        size = (param.get("n_predators", 1), param["d"])
+        # start the predators off in the lower corner
+        param["predator_xy"] = rng.uniform(low = low - 10, high = high - 10, size = size).astype(dtype)
+        param["predator_old"] = rng.uniform(low = low - 10, high = high - 10, size = size).astype(dtype)
+        dt = time_step(param)
+        if dt != 1:
+            # the same velocity per unit time for steps of length dt
+            param["predator_old"] = (param["predator_xy"] - dt * (param["predator_xy"] - param["predator_old"])).astype(dtype)
+
+    def apply(self, agent_temp, agent_now, param, buffers):
+        if "dist_predator" not in buffers:
+            buffers["dist_predator"] = np.empty_like(buffers["dist"])
+        # old because the reaction times of the agents are delayed
+        add_pulls(agent_temp, param["predator_old"], agent_now, param["predator_push"], power = self.power,
+                  dist = buffers["dist_predator"])
+
+    def advance(self, param, buffers):
+        predator_now = param["predator_xy"]
+        predator_old = param["predator_old"]
+        C = buffers["C_flock"]
+        # C is the one of the last positions, the reaction time of the predators is not 0 either
+        predator_pull = param["predator_pull"] * time_step(param)**2
+        predator_temp = 2 * predator_now - predator_old + \
+            predator_pull * (C - predator_now) / euclidian_dist((C - predator_now), axis = 1)[:, None]
+        predator_old[:] = predator_now
+        predator_now[:] = predator_temp
+
+class FoodPull(ForceTerm):
+    '''
+    Shift of all agents by factor * param["food_pull"] towards the food sources in
+    param["food_xy"] (n_food, d), summed over the sources. The food acts on the center of mass
+    of the flock, hence the shift is the same for every agent. With an exponent, the shift of
+    a source is |unit vector**exponent| instead of the unit vector. buffers["dist_food"] holds
+    the distance of the center of mass to every source.
+    '''
+    flock_center = True
+
+    def __init__(self, exponent = None, factor = 1.0):
+        self.exponent = exponent
+        self.factor = factor
+
+    def initialize(self, param, dtype = np.float64, rng = None):
+        rng = np.random if rng is None else rng
+        lower_lim, upper_lim = param["ax_lim"]
+        param["food_xy"] = rng.uniform(lower_lim, upper_lim, size = (param.get("n_food", 1), param["d"])).astype(dtype)
+
+    def apply(self, agent_temp, agent_now, param, buffers):
+        food_pull = self.factor * param["food_pull"]
+        food_delta = buffers["C_flock"] - param["food_xy"]
+        buffers["dist_food"] = euclidian_dist(food_delta, axis = 1)
+        food_dist = buffers["dist_food"][:, None]
+        if self.exponent is None:
+            agent_temp += np.sum((-food_pull) * food_delta / food_dist, axis = 0)
+        else:
+            agent_temp += np.sum((-food_pull) * abs((food_delta / abs(food_dist))**self.exponent), axis = 0)
+
+# force terms of the built-in modes, the terms keep no state of their own
+MODE_FORCES = {"basic": (CenterPull(),),
+               "predator": (CenterPull(), PredatorPush())}
+# force terms forces_from_config can rebuild
+FORCE_TERMS = {term.__name__: term for term in (CenterPull, PredatorPush, ChasingPredators, FoodPull)}
+
+def forces_from_config(config):
+    '''
+    Rebuilds the force terms from their descriptions of ForceTerm.config
+    '''
+    forces = []
+    for term_config in config:
+        options = dict(term_config)
+        name = options.pop("term")
+        if name not in FORCE_TERMS:
+            raise ValueError(f"Unknown force term {name}. Pass the force terms of the run as forces.")
+        forces.append(FORCE_TERMS[name](**options))
+
+    return forces
+
+def step_centers(agent_now, param, forces, buffers):
+    '''
+    Computes the center of mass of the flock (C_flock, if the interaction or a term needs it)
+    and the one the agents steer to (C) into the buffers
+    '''
+    global_interaction = param.get("interaction", "global") == "global"
+    C_flock = None
+    if global_interaction or any(term.flock_center for term in forces):
+        C_flock = np.mean(agent_now, axis=0, dtype=np.float64)
+    buffers["C_flock"] = C_flock
+    buffers["C"] = C_flock if global_interaction else center_of_mass(agent_now, param)
+
+def update_forces(agent_now, agent_old, param, forces, buffers = None):
+    '''
+    Position-Verlet step with a sequence of force terms, the kernel of every mode. The centers
+    of mass are computed once and shared by the terms, which all add into the same output.
+
+    Parameters
+    ----------
+    agent_now : array (n, d)
+    agent_old : array (n, d)
+    param : dict
+        param["periodic"] = False skips the periodic boundaries, agent_plot is agent_temp then
+        (as for steps with buffers["wrap"] = False, see needs_wrap).
+        param["integrator"] = "adaptive" switches to update_adaptive.
+    forces : sequence of ForceTerm
+    buffers : dict, optional
+        preallocated arrays from allocate_buffers, the outputs are written into them.
+
+    Returns
+    -------
+    agent_temp : array (n, d)
+        updated positions.
+    agent_plot : array (n, d)
+        updated positions within the periodic boundaries.
+    param : dict
+
+    '''
+    if param.get("integrator", "verlet") == "adaptive":
+        return update_adaptive(agent_now, agent_old, param, forces, buffers)
+    if buffers is None:
+        buffers = allocate_buffers(*agent_now.shape, dtype = agent_now.dtype)
+    agent_temp = buffers["agent_temp"]
+
+    # calculate center of mass, kept for the terms and the metrics of the step
+    step_centers(agent_now, param, forces, buffers)
+
+    verlet_step(agent_now, agent_old, agent_temp)
+    for term in forces:
+        term.apply(agent_temp, agent_now, param, buffers)
+    for term in forces:
+        term.advance(param, buffers)
+
+    # returning an array for plotting a one with accurate positions, such that periodic boundaries do not intetfere with CoM calculations
+    if needs_wrap(param, buffers):
+        agent_plot = periodic_boundaries(agent_temp, param, buffers["agent_plot"])
+    else:
+        agent_plot = agent_temp
+
+    return agent_temp, agent_plot, param
+
+def update_adaptive(agent_now, agent_old, param, forces, buffers = None):
+    '''
+    Position-Verlet step of length param["dt"] (default 1) with substeps for the agents under
+    strong forces, e.g. close to a predator. An agent whose force displacement a * dt**2 exceeds
+    param["max_displacement"] (default 0.5) is moved in s = 2**k substeps of length dt / s,
+    with s * s * max_displacement >= a * dt**2 and s <= param["max_substeps"] (default 64,
+    rounded down to a power of two).
+    The substeps see the centers of mass and the predators of the step (they are frozen
+    during the step), such that only the forces of the substepped agents are evaluated again.
+
+    Parameters
+    ----------
+    agent_now, agent_old, param, forces, buffers
+        as for update_forces.
+
+    Returns
+    -------
+    agent_temp, agent_plot, param
+        as for update_forces. buffers["substepped"] holds the indices of the substepped agents
+        and their last positions for the next step, (idx, agent_old), or None;
+        buffers["n_substeps"] the number of substeps of the step.
+
+    '''
+    if buffers is None:
+        buffers = allocate_buffers(*agent_now.shape, dtype = agent_now.dtype)
+    n, d = agent_now.shape
+    agent_temp = buffers["agent_temp"]
+    dt = param.get("dt", 1.0)
+    max_displacement = param.get("max_displacement", 0.5)
+    max_substeps = param.get("max_substeps", 64)
+    if "accel" not in buffers:
+        buffers["accel"] = np.empty_like(agent_temp)
+    accel = buffers["accel"]
+
+    step_centers(agent_now, param, forces, buffers)
+    accel[:] = 0
+    for term in forces:
+        term.apply(accel, agent_now, param, buffers)
+    accel *= dt * dt
+
+    # substeps per agent from its force, rounded up to powers of two to group the agents
+    np.einsum("ij,ij->i", accel, accel, out = buffers["dist"])
+    ratio = np.sqrt(np.sqrt(buffers["dist"]) / max_displacement)
+    # the largest power of two within max_substeps caps the levels
+    max_level = int(np.floor(np.log2(max_substeps)))
+    levels = np.minimum(np.ceil(np.log2(np.maximum(ratio, 1))), max_level).astype(np.intp)
+
+    verlet_step(agent_now, agent_old, agent_temp)
+    agent_temp += accel
+    substepped_idx = []
+    substepped_old = []
+    buffers["n_substeps"] = n
+    for level in np.unique(levels[levels > 0]):
+        idx = np.flatnonzero(levels == level)
+        s = 2**level
+        # state of the substeps, the velocity of the step is spread over s substeps
+        sub = allocate_buffers(len(idx), d, dtype = agent_now.dtype)
+        sub["C_flock"] = buffers["C_flock"]
+        sub["C"] = buffers["C"] if np.ndim(buffers["C"]) == 1 else buffers["C"][idx]
+        y = agent_now[idx]
+        y_old = y - (y - agent_old[idx]) / s
+        y_accel = np.empty_like(y)
+        for k in range(s):
+            y_accel[:] = 0
+            for term in forces:
+                term.apply(y_accel, y, param, sub)
+            y_new = 2 * y - y_old + y_accel * (dt / s)**2
+            y_old, y = y, y_new
+        agent_temp[idx] = y
+        # the agents leave the step with the velocity of their last substep
+        substepped_idx.append(idx)
+        substepped_old.append(y - (y - y_old) * s)
+        buffers["n_substeps"] += (s - 1) * len(idx)
+    buffers["substepped"] = (np.concatenate(substepped_idx), np.concatenate(substepped_old)) if substepped_idx else None
+
+    for term in forces:
+        term.advance(param, buffers)
+
+    if needs_wrap(param, buffers):
+        agent_plot = periodic_boundaries(agent_temp, param, buffers["agent_plot"])
+    else:
+        agent_plot = agent_temp
+
+    return agent_temp, agent_plot, param
+
+def make_update(forces):
+    '''
+    Step kernel with the signature of update for a sequence of force terms, which are
+    registered once instead of being looked up in every step
+    '''
+    forces = tuple(forces)
+    def update_func(agent_now, agent_old, param, buffers = None):
+        return update_forces(agent_now, agent_old, param, forces, buffers)
+
+    return update_func
+
+def update(agent_now, agent_old, param, buffers = None):
+    '''
+    Update of the postion of the agents, with the assumption that their acceleretion is computed from
+    their pull towards the center of mass and the delta between their new and old position
+    Parameters
+    ----------
+    agent_now : array (n, d)
+        DESCRIPTION.
+    agent_old : array (n, d)
+        DESCRIPTION.
+    center_pull : int, optional
+        DESCRIPTION. The default is 1.5.
+    buffers : dict, optional
+        preallocated arrays from allocate_buffers, the outputs are written into them.
+
+    Returns
+    -------
+    agent_temp : updated positon of agents
+
+    '''
+    return update_forces(agent_now, agent_old, param, MODE_FORCES["basic"], buffers)
+
+def update_predator(agent_now, agent_old, param, buffers = None):
+    '''
+    Update of the postion of the agents, with the assumption that their acceleretion is computed from
+    their pull towards the center of mass and the delta between their new and old position
+    Parameters
+    ----------
+    agent_now : array (n, d)
+        DESCRIPTION.
+    agent_old : array (n, d)
+        DESCRIPTION.
+    center_pull : int, optional
+        DESCRIPTION. The default is 1.5.
+    buffers : dict, optional
+        preallocated arrays from allocate_buffers, the outputs are written into them.
+
+    Returns
+    -------
+    agent_temp : updated positon of agents
+
+    '''
+    return update_forces(agent_now, agent_old, param, MODE_FORCES["predator"], buffers)
+
+def select_update(mode, backend = "numpy", forces = None):
+    '''
+    Step kernel of a mode and backend
+
+    Parameters
+    ----------
+    mode : str
+        "basic" or "predator".
+    backend : str, optional
+        "numpy" or "numba" (compiled, parallel over the agents). Without numba installed
+        the numpy backend is used. The default is "numpy".
+    forces : sequence of ForceTerm, optional
+        force terms instead of the ones of the mode, they run on the numpy backend. The
+        default is None.
+
+    Returns
+    -------
+    update_func : callable
+        update or update_predator of the backend.
+
+    '''
+    if forces is not None:
+        if backend == "numba":
+            warnings.warn("The numba backend only compiles the position-Verlet step of the built-in modes, "
+                          "using the numpy backend.")
+        return make_update(forces)
+    if mode not in ("basic", "predator"):
+        raise ValueError("Unknown mode. Choose 'basic' or 'predator'.")
+    name = "update" if mode == "basic" else "update_predator"
+    if backend == "numba":
+        # numba is only imported when it is asked for, its import takes a while
+        import flocking_numba
+        if flocking_numba.NUMBA_AVAILABLE:
+            return getattr(flocking_numba, name)
+        warnings.warn("Numba is not installed, falling back to the numpy backend.")
+    elif backend != "numpy":
+        raise ValueError("Unknown backend. Choose 'numpy' or 'numba'.")
+
+    return globals()[name]
+
+def wants_frame(observer, i):
+    '''
+    Whether observer draws or stores the positions of step i, as told by its wants_frame(i)
+    method. Observers without one get every frame.
+    '''
+    wants = getattr(observer, "wants_frame", None)
+
+    return True if wants is None else wants(i)
+
+def run_simulation(mode = "basic",
+                   d = 2,
+                   param = {"n" : 100,
+                            "init_coord":(-1, 1),
+                            "ax_lim": (-50, 50),
+                            "steps": 500,
+                            "center_pull": 1.5,
+                            "predator_push": 1.5,
+                            "predator_pull": 1.5,
+                            "interaction": "global",
+                            "neighbour_radius": 5,
+                            "k_neighbours": 7},
+                   observers = (),
+                   store_positions = True,
+                   trajectory_file = None,
+                   stride = 1,
+                   trajectory_dtype = np.float32,
+                   trajectory_precision = None,
+                   write_buffers = 2,
+                   backend = "numpy",
+                   dtype = np.float64,
+                   checkpoint_file = None,
+                   checkpoint_every = 1000,
+                   state = None,
+                   metrics = (),
+                   forces = None,
+                   rng = None):
+    '''
+    Headless simulation engine, it never imports matplotlib. Plotting (or any other per step
+    output) is attached as an observer.
+
+    Parameters
+    ----------
+    mode : str, optional
+        "basic" or "predator". The default is "basic".
+    d : int, optional
+        number of dimensions. The default is 2.
+    param : dict, optional
+        as for simulate_flocking.
+    observers : sequence of callables, optional
+        called as observer(i, agent_plot, param) after every step i. An observer with a
+        method wants_frame(i) gets agent_plot None for the steps it declines, their positions
+        are not wrapped unless another observer or store_positions needs them. The default is ().
+    store_positions : bool, optional
+        keep the positions of every step in memory. The default is True.
+    trajectory_file : str, optional
+        stream the positions to this .npy file instead of keeping them in memory. The default is None.
+    stride : int, optional
+        store every stride-th step in trajectory_file. The default is 1.
+    trajectory_dtype : data type, optional
+        dtype of the positions in trajectory_file. The default is np.float32.
+    trajectory_precision : float, optional
+        store trajectory_file as compressed delta trajectory, with the positions quantized to
+        this fraction of the box (e.g. 1e-4), see DeltaTrajectoryWriter. The default is None
+        (.npy file of trajectory_dtype).
+    write_buffers : int, optional
+        frames of trajectory_file in flight: they are written by a background thread while
+        the next steps are computed, and the simulation waits when all of them are queued.
+        0 writes every frame within the step. The default is 2, see AsyncTrajectoryWriter.
+    backend : str, optional
+        "numpy" or "numba", see select_update. The default is "numpy".
+    dtype : data type, optional
+        dtype of the agent state and of the positions kept in memory. np.float32 halves the
+        memory traffic, centers of mass are still accumulated in float64. The default is np.float64.
+    checkpoint_file : str, optional
+        write the state to this file every checkpoint_every steps, see resume_simulation.
+        The default is None.
+    checkpoint_every : int, optional
+        steps between checkpoints. The default is 1000.
+    state : dict, optional
+        state of a checkpoint to continue from, instead of initializing the agents. The
+        default is None.
+    metrics : sequence of callables, optional
+        called as metric(i, agent_now, buffers, param) right after the step kernel of step i,
+        while the buffers hold its center of mass and distances, see FlockMetrics. The
+        default is ().
+    forces : sequence of ForceTerm, optional
+        force terms of the step instead of the ones of the mode, e.g. [CenterPull(),
+        ChasingPredators(), FoodPull()]. They are initialized after the agents. The default
+        is None.
+    rng : np.random.Generator, SeedSequence or int, optional
+        random stream of the initial state, independent of the global state such that runs
+        in parallel threads or processes are reproducible. The default is None (global numpy
+        random state, seeded with np.random.seed).
+
+    Returns
+    -------
+    positions : array (steps+1, n, d)
+        positions after periodic boundaries, a read-only memory map (or DeltaTrajectory) of
+        trajectory_file if it is given and None if store_positions is False. A resumed run keeps only the steps from
+        the checkpoint on in memory.
+
+    '''
+    if forces is None and backend == "numba" and param.get("integrator", "verlet") != "verlet":
+        # the compiled kernels only integrate with the plain position-Verlet step
+        forces = MODE_FORCES[mode]
+    update_func = select_update(mode, backend, forces)
+    rng = None if rng is None else as_generator(rng)
+    steps = param["steps"]
+    n = param["n"]
+    # arguments a resumed run continues with
+    config = {"mode": mode, "d": d, "store_positions": store_positions, "trajectory_file": trajectory_file,
+              "stride": stride, "trajectory_dtype": np.dtype(trajectory_dtype).name,
+              "trajectory_precision": trajectory_precision, "write_buffers": write_buffers,
+              "backend": backend, "forces": None if forces is None else [term.config() for term in forces],
+              "dtype": np.dtype(dtype).name, "checkpoint_file": checkpoint_file, "checkpoint_every": checkpoint_every}
+
+    if state is None:
+        first_step = 0
+        param["d"] = d
+        # neighbour lists are only valid for the run they were built in
+        param["knn_state"] = {}
+        agent_old, agent_now, param = initialize_agents(param, dtype = dtype, rng = rng)
+        for term in MODE_FORCES[mode] if forces is None else forces:
+            term.initialize(param, dtype, rng)
+    else:
+        first_step = state["step"]
+        agent_now, agent_old = state["agent_now"], state["agent_old"]
+        if rng is None:
+            # only a run on the global random state restores it
+            np.random.set_state(state["rng_state"])
+    # work arrays of the step kernel, reused in every step
+    buffers = allocate_buffers(n, d, dtype = dtype)
+
+    positions = None
+    writer = None
+    if trajectory_file is not None:
+        store_positions = False
+        if trajectory_precision is None:
+            writer = TrajectoryWriter(trajectory_file, n, d, steps, stride = stride, dtype = trajectory_dtype,
+                                      param = param, resume = state is not None)
+        else:
+            writer = DeltaTrajectoryWriter(trajectory_file, n, d, steps, stride = stride, dtype = trajectory_dtype,
+                                           param = param, resume = state is not None, precision = trajectory_precision)
+        if state is None:
+            writer.write(0, agent_now)
+        if write_buffers:
+            writer = AsyncTrajectoryWriter(writer, n, d, n_buffers = write_buffers)
+        observers = [writer, *observers]
+    elif store_positions:
+        positions = np.zeros((steps+1 - first_step, n, d), dtype = dtype)
+        # the state of a resumed run is unwrapped, its first frame is wrapped like the others
+        wrap = first_step and param.get("periodic", True)
+        positions[0, :, :] = periodic_boundaries(agent_now, param, np.empty_like(agent_now)) if wrap else agent_now
+
+    # the kernel writes into the ring, which is rotated instead of copying the positions
+    ring = StateRing(agent_now, agent_old, buffers)
+    for i in range(first_step, steps):
+        # the state stays unwrapped, positions are only wrapped for frames that are stored or drawn
+        wanted = [wants_frame(observer, i) for observer in observers]
+        buffers["wrap"] = store_positions or any(wanted)
+        if store_positions:
+            # the periodic positions are written straight into the stored frame
+            buffers["agent_plot"] = positions[i+1 - first_step]
+        agent_temp, agent_plot, param = update_func(ring.now, ring.old, param, buffers)
+        for metric in metrics:
+            metric(i, ring.now, buffers, param)
+        # store updated and this position for next acceleration
+        ring.rotate()
+        if buffers.get("substepped") is not None:
+            idx, old = buffers["substepped"]
+            ring.old[idx] = old
+
+        if store_positions and agent_plot is not buffers["agent_plot"]:
+            positions[i+1 - first_step, :, :] = agent_plot
+        for observer, wants in zip(observers, wanted):
+            observer(i, agent_plot if wants else None, param)
+        if checkpoint_file is not None and (i+1) % checkpoint_every == 0:
+            if writer is not None:
+                # the trajectory has to hold every frame the checkpoint has passed
+                writer.flush()
+            save_checkpoint(checkpoint_file, {"step": i+1, "agent_now": ring.now, "agent_old": ring.old,
+                                              "param": param, "config": config, "rng": rng,
+                                              "rng_state": np.random.get_state() if rng is None else None})
+
+    if writer is not None:
+        writer.close()
+        positions = open_trajectory(trajectory_file)
+
+    return positions
+
+def resume_simulation(checkpoint_file, observers = (), metrics = (), forces = None):
+    '''
+    Continues a simulation of run_simulation from its last checkpoint. The run continues
+    bit for bit as if it had not been interrupted, with the same arguments and random stream:
+    the np.random.Generator of the run, or the global random state for runs without one (only
+    then is the global state restored).
+
+    Parameters
+    ----------
+    checkpoint_file : str
+        file written by run_simulation.
+    observers : sequence of callables, optional
+        observers of the remaining steps. The default is ().
+    metrics : sequence of callables, optional
+        metrics of the remaining steps. The default is ().
+    forces : sequence of ForceTerm, optional
+        the force terms of the run, needed only for terms other than the built-in ones. The
+        default is None (the terms stored in the checkpoint).
+
+    Returns
+    -------
+    positions : array
+        as returned by run_simulation.
+
+    '''
+    state = load_checkpoint(checkpoint_file)
+    config = state["config"]
+    if forces is None and config.get("forces") is not None:
+        forces = forces_from_config(config["forces"])
+
+    return run_simulation(mode = config["mode"], d = config["d"], param = state["param"], observers = observers,
+                          metrics = metrics, forces = forces,
+                          store_positions = config["store_positions"], trajectory_file = config["trajectory_file"],
+                          stride = config["stride"], trajectory_dtype = np.dtype(config["trajectory_dtype"]),
+                          trajectory_precision = config.get("trajectory_precision"),
+                          write_buffers = config.get("write_buffers", 2),
+                          backend = config["backend"], dtype = np.dtype(config["dtype"]),
+                          checkpoint_file = config["checkpoint_file"], checkpoint_every = config["checkpoint_every"],
+                          state = state, rng = state["rng"])
+
+def precision_error(mode = "basic",
+                    d = 2,
+                    param = {"n" : 100,
+                             "init_coord":(-1, 1),
+                             "ax_lim": (-50, 50),
+                             "steps": 500,
+                             "center_pull": 1.5,
+                             "predator_push": 1.5,
+                             "predator_pull": 1.5,
+                             "interaction": "global",
+                             "neighbour_radius": 5,
+                             "k_neighbours": 7},
+                    dtype = np.float32,
+                    seed = 0,
+                    backend = "numpy"):
+    '''
+    Accuracy check of a reduced precision run against the float64 reference with the same
+    initial positions
+
+    Parameters
+    ----------
+    mode : str, optional
+        "basic" or "predator". The default is "basic".
+    d : int, optional
+        number of dimensions. The default is 2.
+    param : dict, optional
+        as for run_simulation, every run gets its own copy. The default is the one of
+        run_simulation.
+    dtype : data type, optional
+        precision to check. The default is np.float32.
+    seed : int or SeedSequence, optional
+        seed of the initial positions, the same for both runs. The default is 0.
+
+    Returns
+    -------
+    error : array (steps+1,)
+        largest deviation of an agent from the reference in every step, relative to the
+        width of the box.
+
+    '''
+    runs = []
+    for run_dtype in (np.float64, dtype):
+        runs.append(run_simulation(mode = mode, d = d, param = dict(param), backend = backend, dtype = run_dtype,
+                                   rng = np.random.default_rng(seed)))
+    lower_lim, upper_lim = param["ax_lim"]
+    reference, reduced = runs
+
+    return np.max(np.abs(reduced - reference), axis = (1, 2)) / (upper_lim - lower_lim)
@@ -0,0 +1,209 @@
+import numpy as np
+from flocking_engine import allocate_buffers, StateRing, verlet_step, add_pull, periodic_boundaries, needs_wrap
+from flocking_init import initial_positions, spawn_generators
+
+
+def replicate_param(param, key, n_replicates):
+    '''
+    Returns the parameter key as a column of one value per replicate, such that it broadcasts
+    against the (B, n) distances of the step kernel
+
+    Parameters
+    ----------
+    param : dict
+        param[key] is either a scalar shared by all replicates or a sequence of length B.
+    key : str
+    n_replicates : int
+
+    Returns
+    -------
+    values : array (B, 1)
+
+    '''
+    values = np.asarray(param[key], dtype = float)
+    if values.ndim > 1 or (values.ndim == 1 and len(values) != n_replicates):
+        raise ValueError(f"param['{key}'] must be a scalar or hold one value per replicate.")
+
+    return np.broadcast_to(values, (n_replicates,)).reshape(n_replicates, 1)
+
+def initialize_ensemble(param, n_replicates, predator = False, dtype = np.float64, rngs = None):
+    '''
+    This function initializes B independent flocks of the same size
+
+    Parameters
+    ----------
+    param : dict
+        Holds the necessary parameters.
+    n_replicates : int
+        number of flocks B.
+    predator : bool, optional
+        initialize one predator per flock in param["predator_xy"] (B, d). The default is False.
+    dtype : data type, optional
+        dtype of the agent and predator state. The default is np.float64.
+    rngs : sequence of np.random.Generator, or a seed, optional
+        one independent random stream per replicate, a seed (int, SeedSequence or Generator)
+        is spawned into B child streams. The default is None (global numpy random state).
+
+    Raises
+    ------
+    ValueError
+        Dimension is not supplied or invalid.
+
+    Returns
+    -------
+    agent_old : np.ndarray (B, n, d)
+        Zeros.
+    agent_now : np.ndarray (B, n, d)
+        Initial positions of agents.
+
+    '''
+    n = param["n"]
+    d = param["d"]
+    low, high = param["init_coord"]
+    lower_lim, upper_lim = param["ax_lim"]
+    if d not in (2, 3):
+        raise ValueError("Incorrect number of dimensions. Choose d=2 or d=3.")
+
+    if rngs is not None and not isinstance(rngs, (list, tuple)):
+        rngs = spawn_generators(rngs, n_replicates)
+    if rngs is None and param.get("init", "uniform") == "uniform":
+        # all flocks in one draw
+        agent_now = np.random.uniform(low=low, high=high, size=(n_replicates, n, d)).astype(dtype, copy = False)
+    else:
+        rngs = [None] * n_replicates if rngs is None else rngs
+        agent_now = np.stack([initial_positions(param, rng) for rng in rngs]).astype(dtype, copy = False)
+    agent_old = np.zeros_like(agent_now)
+    if predator:
+        corners = [lower_lim + 1, upper_lim - 1]
+        if rngs is None:
+            predator_xy = np.random.choice(corners, size = (n_replicates, d), replace = True)
+        else:
+            predator_xy = np.stack([rng.choice(corners, size = d, replace = True) for rng in rngs])
+        param["predator_xy"] = predator_xy.astype(dtype)
+
+    return agent_old, agent_now, param
+
+def update_ensemble(agent_now, agent_old, param, buffers = None, predator = False):
+    '''
+    Update of the postion of the agents of all flocks in one vectorized step, each flock with
+    its own center of mass and (optionally) predator
+
+    Parameters
+    ----------
+    agent_now : array (B, n, d)
+    agent_old : array (B, n, d)
+    param : dict
+        center_pull, predator_push and predator_pull may hold one value per replicate.
+    buffers : dict, optional
+        preallocated arrays from allocate_buffers(n, d, replicates = B).
+    predator : bool, optional
+        include the push from param["predator_xy"] (B, d). The default is False.
+
+    Returns
+    -------
+    agent_temp : array (B, n, d)
+        updated positon of agents
+    agent_plot : array (B, n, d)
+        updated position after periodic boundaries
+
+    '''
+    n_replicates, n, d = agent_now.shape
+    if buffers is None:
+        buffers = allocate_buffers(n, d, dtype = agent_now.dtype, replicates = n_replicates)
+    if param.get("interaction", "global") != "global":
+        raise ValueError("Ensembles only support the global interaction.")
+    agent_temp = buffers["agent_temp"]
+
+    # center of mass of every flock, accumulated in float64
+    C = np.mean(agent_now, axis = 1, keepdims = True, dtype = np.float64)
+
+    verlet_step(agent_now, agent_old, agent_temp)
+    add_pull(agent_temp, C, agent_now, replicate_param(param, "center_pull", n_replicates), buffers)
+    if predator:
+        predator_xy = param["predator_xy"]
+        add_pull(agent_temp, predator_xy[:, None, :], agent_now,
+                 replicate_param(param, "predator_push", n_replicates), buffers)
+        # every predator is placed at predator_pull from the origin, in its direction from the
+        # center of mass of its flock
+        predator_delta = predator_xy - C[:, 0, :]
+        predator_xy[:] = replicate_param(param, "predator_pull", n_replicates) * predator_delta / \
+            np.sqrt(np.sum(predator_delta**2, axis = 1, keepdims = True))
+
+    if needs_wrap(param, buffers):
+        agent_plot = periodic_boundaries(agent_temp, param, buffers["agent_plot"])
+    else:
+        agent_plot = agent_temp
+
+    return agent_temp, agent_plot
+
+def simulate_ensemble(n_replicates,
+                      mode = "basic",
+                      d = 2,
+                      store_positions = True,
+                      dtype = np.float64,
+                      rngs = None,
+                      param = {"n" : 100,
+                               "init_coord":(-1, 1),
+                               "ax_lim": (-50, 50),
+                               "steps": 500,
+                               "center_pull": 1.5,
+                               "predator_push": 1.5,
+                               "predator_pull": 1.5}):
+    '''
+    Simulates B independent flocks at once, e.g. for parameter studies of center_pull
+
+    Parameters
+    ----------
+    n_replicates : int
+        number of flocks B.
+    mode : str, optional
+        "basic" or "predator". The default is "basic".
+    d : int, optional
+        number of dimensions. The default is 2.
+    store_positions : bool, optional
+        return the positions of every step, otherwise only of the last one. The default is True.
+    dtype : data type, optional
+        dtype of the agent state and stored positions. The default is np.float64.
+    rngs : sequence of np.random.Generator, or a seed, optional
+        one random stream per replicate, see initialize_ensemble. The default is None.
+    param : dict, optional
+        as for simulate_flocking, center_pull, predator_push and predator_pull can be
+        sequences with one value per replicate.
+
+    Returns
+    -------
+    positions : array (B, steps+1, n, d) or (B, n, d)
+        positions after periodic boundaries.
+
+    '''
+    if mode not in ("basic", "predator"):
+        raise ValueError("Unknown mode. Choose 'basic' or 'predator'.")
+    predator = mode == "predator"
+    steps = param["steps"]
+    n = param["n"]
+    param["d"] = d
+
+    agent_old, agent_now, param = initialize_ensemble(param, n_replicates, predator = predator, dtype = dtype, rngs = rngs)
+    buffers = allocate_buffers(n, d, dtype = dtype, replicates = n_replicates)
+    if store_positions:
+        positions = np.zeros((n_replicates, steps+1, n, d), dtype = dtype)
+        positions[:, 0] = agent_now
+
+    # the kernel writes into the ring, which is rotated instead of copying the positions
+    ring = StateRing(agent_now, agent_old, buffers)
+    agent_plot = agent_now
+    for i in range(steps):
+        # without stored positions only the last step is wrapped
+        buffers["wrap"] = store_positions or i == steps - 1
+        if store_positions:
+            # the periodic positions are written straight into the stored frames
+            buffers["agent_plot"] = positions[:, i+1]
+        agent_temp, agent_plot = update_ensemble(ring.now, ring.old, param, buffers, predator = predator)
+        # store updated and this position for next acceleration
+        ring.rotate()
+        if store_positions and agent_plot is not buffers["agent_plot"]:
+            positions[:, i+1] = agent_plot
+
+    if store_positions:
+        return positions
+    return agent_plot.copy()
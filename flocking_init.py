@@ -0,0 +1,234 @@
+import warnings
+import numpy as np
+
+# the initializers draw from rng, a np.random.Generator (one independent stream per replicate)
+# or, by default, the global numpy random state, which seeds and checkpoints of the engine use
+
+
+def as_generator(seed):
+    '''
+    Random stream of seed: an int, a np.random.SeedSequence or a np.random.Generator, which
+    is returned as it is
+    '''
+    if isinstance(seed, np.random.Generator):
+        return seed
+
+    return np.random.default_rng(seed)
+
+def spawn_generators(seed, n):
+    '''
+    n independent child streams of seed (int, SeedSequence or Generator), e.g. one per
+    replicate. The streams only depend on seed and their index, not on where they are used,
+    such that parallel runs are reproducible.
+
+    Returns
+    -------
+    rngs : list of np.random.Generator
+
+    '''
+    if isinstance(seed, np.random.Generator):
+        return seed.spawn(n)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    return [np.random.default_rng(child) for child in seed.spawn(n)]
+
+def uniform_positions(n, d, low, high, rng = None):
+    '''
+    Agents uniformly distributed in the cube [low, high)**d
+    '''
+    rng = np.random if rng is None else rng
+
+    return rng.uniform(low=low, high=high, size=(n, d))
+
+def gaussian_positions(n, d, center, std, rng = None):
+    '''
+    One Gaussian cluster of agents around center (scalar or (d,)) with standard deviation std
+    '''
+    rng = np.random if rng is None else rng
+
+    return rng.normal(loc=center, scale=std, size=(n, d))
+
+def mixture_positions(n, d, centers, std, weights = None, rng = None):
+    '''
+    Agents drawn from a mixture of Gaussian clusters
+
+    Parameters
+    ----------
+    n : int
+        number of agents.
+    d : int
+        number of dimensions.
+    centers : array (k, d)
+        centers of the k clusters.
+    std : float or array (k,)
+        standard deviation of every cluster.
+    weights : array (k,), optional
+        probability of every cluster. The default is None (equal weights).
+    rng : np.random.Generator, optional
+
+    Returns
+    -------
+    positions : array (n, d)
+
+    '''
+    rng = np.random if rng is None else rng
+    centers = np.asarray(centers, dtype = float)
+    std = np.broadcast_to(np.asarray(std, dtype = float), (len(centers),))
+    # cluster of every agent, then all offsets at once
+    labels = rng.choice(len(centers), size = n, p = weights)
+
+    return centers[labels] + std[labels, None] * rng.normal(size=(n, d))
+
+def lattice_positions(n, d, low, high, packing = "square", jitter = 0.0, rng = None):
+    '''
+    Agents on a lattice filling the cube [low, high)**d, row by row
+
+    Parameters
+    ----------
+    n : int
+        number of agents.
+    d : int
+        number of dimensions.
+    low, high : float
+        limits of the cube.
+    packing : str, optional
+        "square" (simple cubic lattice) or "hex", the densest packing: triangular in 2D and
+        face-centered cubic in 3D. The default is "square".
+    jitter : float, optional
+        uniform displacement of every agent, as a fraction of the lattice spacing. The
+        default is 0.
+    rng : np.random.Generator, optional
+        only needed with jitter.
+
+    Returns
+    -------
+    positions : array (n, d)
+
+    '''
+    width = high - low
+    if packing == "square":
+        m = int(np.ceil(n ** (1 / d) - 1e-9))
+        points = np.indices((m,) * d).reshape(d, -1).T[:n] + 0.5
+        spacing = width / m
+    elif packing == "hex" and d == 2:
+        # rows of the triangular lattice are shifted by half a spacing, sqrt(3)/2 apart
+        spacing = width * np.sqrt(2 / (np.sqrt(3) * n))
+        while True:
+            columns = int(width // spacing)
+            rows = int(width // (spacing * np.sqrt(3) / 2))
+            if columns * rows >= n:
+                break
+            spacing *= 0.99
+        row, column = np.divmod(np.arange(n), columns)
+        points = np.stack([column + 0.5 * (row % 2) + 0.25, (row + 0.5) * np.sqrt(3) / 2], axis = 1)
+    elif packing == "hex" and d == 3:
+        # face-centered cubic, four agents per cubic cell
+        m = int(np.ceil((n / 4) ** (1 / 3) - 1e-9))
+        basis = np.array([[0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+        cells = np.indices((m,) * 3).reshape(3, -1).T
+        points = (cells[:, None, :] + basis[None, :, :]).reshape(-1, 3)[:n] + 0.25
+        spacing = width / m
+    else:
+        raise ValueError("Unknown packing. Choose 'square' or 'hex' in 2 or 3 dimensions.")
+    positions = low + points * spacing
+    if jitter:
+        rng = np.random if rng is None else rng
+        positions += rng.uniform(-jitter, jitter, size=(n, d)) * spacing
+
+    return positions
+
+def radical_inverse(index, base):
+    '''
+    Van der Corput sequence of index in base, the digits of all indices are reversed at once
+    '''
+    index = np.array(index, dtype = np.int64)
+    result = np.zeros(index.shape)
+    factor = 1 / base
+    while np.any(index > 0):
+        index, digit = np.divmod(index, base)
+        result += factor * digit
+        factor /= base
+
+    return result
+
+PRIMES = (2, 3, 5, 7, 11, 13)
+
+def halton_positions(n, d, low, high, rng = None):
+    '''
+    Low-discrepancy Halton points in the cube [low, high)**d. A random shift (modulo the cube)
+    makes the points of different replicates independent.
+    '''
+    rng = np.random if rng is None else rng
+    index = np.arange(1, n + 1)
+    points = np.stack([radical_inverse(index, PRIMES[j]) for j in range(d)], axis = 1)
+    points = np.mod(points + rng.uniform(size = d), 1)
+
+    return low + points * (high - low)
+
+def sobol_positions(n, d, low, high, rng = None):
+    '''
+    Low-discrepancy Sobol points in the cube [low, high)**d, with a random digital shift per
+    replicate. The sequence is generated by scipy.stats.qmc.
+    '''
+    # scipy is only needed for the Sobol sequence
+    from scipy.stats import qmc
+
+    rng = np.random if rng is None else rng
+    bits = 30
+    with warnings.catch_warnings():
+        # the balance of the sequence for n that are not powers of 2 is fine for initial positions
+        warnings.simplefilter("ignore", UserWarning)
+        points = qmc.Sobol(d, scramble = False, bits = bits).random(n)
+    # digital shift: xor with random bits, which keeps the net properties of the points
+    shift = np.floor(rng.uniform(size = d) * 2**bits).astype(np.uint64)
+    points = ((points * 2**bits).astype(np.uint64) ^ shift) / 2**bits
+
+    return low + points * (high - low)
+
+INITIALIZERS = ("uniform", "gaussian", "mixture", "lattice", "halton", "sobol")
+
+def initial_positions(param, rng = None, n = None):
+    '''
+    Initial positions of the agents, as chosen by param["init"]
+
+    Parameters
+    ----------
+    param : dict
+        init is "uniform" (default), "gaussian", "mixture", "lattice", "halton" or "sobol".
+        All of them place the agents around or within init_coord (low, high); gaussian and
+        mixture clusters have the standard deviation init_std (default (high - low) / 4),
+        mixture draws init_clusters (default 3) centers within init_coord and lattice uses
+        init_packing ("square" or "hex") and init_jitter (default 0).
+    rng : np.random.Generator, optional
+        stream of the positions. The default is None (global numpy random state).
+    n : int, optional
+        number of agents. The default is param["n"].
+
+    Returns
+    -------
+    positions : array (n, d)
+
+    '''
+    n = param["n"] if n is None else n
+    d = param["d"]
+    low, high = param["init_coord"]
+    init = param.get("init", "uniform")
+    std = param.get("init_std", (high - low) / 4)
+
+    if init == "uniform":
+        return uniform_positions(n, d, low, high, rng)
+    elif init == "gaussian":
+        return gaussian_positions(n, d, (low + high) / 2, std, rng)
+    elif init == "mixture":
+        centers = uniform_positions(param.get("init_clusters", 3), d, low, high, rng)
+        return mixture_positions(n, d, centers, std, rng = rng)
+    elif init == "lattice":
+        return lattice_positions(n, d, low, high, packing = param.get("init_packing", "square"),
+                                 jitter = param.get("init_jitter", 0.0), rng = rng)
+    elif init == "halton":
+        return halton_positions(n, d, low, high, rng)
+    elif init == "sobol":
+        return sobol_positions(n, d, low, high, rng)
+    else:
+        raise ValueError(f"Unknown initialization. Choose one of {', '.join(INITIALIZERS)}.")
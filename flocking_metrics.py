@@ -0,0 +1,187 @@
+import numpy as np
+from flocking_neighbours import build_knn_candidates
+
+
+class RunningStats:
+    '''
+    Streaming count, mean, variance, minimum and maximum of a quantity, no samples are kept.
+    Batches of samples are merged into the running mean and variance with the update of
+    Welford (and Chan et al. for batches), which stays accurate over millions of steps.
+
+    Parameters
+    ----------
+    bins : array, optional
+        edges of a histogram of the samples, samples outside the edges are counted in the
+        outer bins. The default is None (no histogram).
+
+    '''
+    def __init__(self, bins = None):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.bins = None if bins is None else np.asarray(bins, dtype = np.float64)
+        self.histogram = None if bins is None else np.zeros(len(self.bins) - 1, dtype = np.int64)
+
+    def add(self, values):
+        '''
+        Adds a sample (float) or a batch of samples (array)
+        '''
+        values = np.asarray(values)
+        count = values.size
+        if count == 0:
+            return
+        mean = np.mean(values, dtype = np.float64)
+        m2 = np.var(values, dtype = np.float64) * count if count > 1 else 0.0
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta**2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, float(np.min(values)))
+        self.max = max(self.max, float(np.max(values)))
+
+        if self.histogram is not None:
+            idx = np.searchsorted(self.bins, values.ravel(), side = "right") - 1
+            np.clip(idx, 0, len(self.histogram) - 1, out = idx)
+            self.histogram += np.bincount(idx, minlength = len(self.histogram))
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+class FlockMetrics:
+    '''
+    Order parameters of the flock, computed during the run from the state the step kernel
+    leaves in its buffers (center of mass C, distances to the center, the predator and the food).
+    Pass it to run_simulation as metrics = [FlockMetrics()]; the trajectory need not be stored.
+    Like the kernel, the metrics see the unwrapped positions.
+
+    Metrics of every step:
+        polarization: norm of the mean direction of motion, 1 for a perfectly aligned flock.
+        mean_speed: mean distance moved in the step.
+        cohesion_radius: rms distance to the center of mass of the flock.
+        center_distance: mean distance to the center of mass every agent steers to (the
+            local one for the radius and knn interactions).
+        predator_distance, predator_min_distance: mean and smallest distance to the (nearest)
+            predator.
+        food_distance, food_min_distance: mean and smallest distance of the center of mass
+            of the flock to the food sources.
+        nearest_neighbour: mean distance to the nearest flockmate, every neighbour_every
+            steps (it needs a KD-tree from scipy).
+
+    Parameters
+    ----------
+    burn_in : int, optional
+        steps before the metrics are recorded. The default is 0.
+    every : int, optional
+        record the metrics every every-th step. The default is 1.
+    neighbour_every : int, optional
+        steps between nearest neighbour distances, 0 switches them off. The default is 10.
+    distance_bins : array, optional
+        edges of the histograms of the per agent distances to the center of mass, to the
+        predator and to the nearest neighbour, kept in agent_stats. The default is None
+        (no per agent statistics).
+    keep_series : bool, optional
+        keep the value of every metric in every recorded step in series. The default is False.
+
+    '''
+    def __init__(self, burn_in = 0, every = 1, neighbour_every = 10, distance_bins = None, keep_series = False):
+        self.burn_in = burn_in
+        self.every = every
+        self.neighbour_every = neighbour_every
+        self.distance_bins = distance_bins
+        self.keep_series = keep_series
+        # statistics over the steps of the per step metrics
+        self.stats = {}
+        # statistics over the agents and steps of the per agent distances
+        self.agent_stats = {}
+        self.last = {}
+        self.series = {}
+        self.steps = []
+
+    def record(self, name, value):
+        if name not in self.stats:
+            self.stats[name] = RunningStats()
+            self.series[name] = []
+        self.stats[name].add(value)
+        self.last[name] = value
+        if self.keep_series:
+            self.series[name].append(value)
+
+    def record_agents(self, name, values):
+        if self.distance_bins is None:
+            return
+        if name not in self.agent_stats:
+            self.agent_stats[name] = RunningStats(self.distance_bins)
+        self.agent_stats[name].add(values)
+
+    def __call__(self, i, agent_now, buffers, param):
+        # called by the engine after the step kernel of step i, before the buffers are reused
+        if i < self.burn_in or (i - self.burn_in) % self.every:
+            return
+        if self.keep_series:
+            self.steps.append(i)
+        diff = buffers["diff"]
+        dist = buffers["dist"]
+        dist_center = buffers["dist_center"]
+        n = len(agent_now)
+
+        # cohesion, the distances to a global center of mass are known from the kernel
+        if np.ndim(buffers["C"]) == 1:
+            cohesion_sq = np.dot(dist_center, dist_center) / n
+        else:
+            np.subtract(agent_now, np.mean(agent_now, axis = 0, dtype = np.float64), out = diff)
+            cohesion_sq = np.einsum("ij,ij->", diff, diff, dtype = np.float64) / n
+        self.record("cohesion_radius", float(np.sqrt(cohesion_sq)))
+        self.record("center_distance", float(np.mean(dist_center, dtype = np.float64)))
+        self.record_agents("center_distance", dist_center)
+
+        if "dist_predator" in buffers:
+            dist_predator = buffers["dist_predator"]
+            self.record("predator_distance", float(np.mean(dist_predator, dtype = np.float64)))
+            self.record("predator_min_distance", float(np.min(dist_predator)))
+            self.record_agents("predator_distance", dist_predator)
+        if "dist_food" in buffers:
+            dist_food = buffers["dist_food"]
+            self.record("food_distance", float(np.mean(dist_food, dtype = np.float64)))
+            self.record("food_min_distance", float(np.min(dist_food)))
+
+        # velocities of the step, from the unwrapped positions
+        np.subtract(buffers["agent_temp"], agent_now, out = diff)
+        np.einsum("ij,ij->i", diff, diff, out = dist)
+        np.sqrt(dist, out = dist)
+        moving = dist > 0
+        n_moving = np.count_nonzero(moving)
+        np.divide(diff, dist[:, None], out = diff, where = moving[:, None])
+        direction = np.sum(diff, axis = 0, dtype = np.float64) / max(n_moving, 1)
+        self.record("mean_speed", float(np.mean(dist, dtype = np.float64)))
+        self.record("polarization", float(np.sqrt(np.dot(direction, direction))))
+
+        if self.neighbour_every and (i - self.burn_in) % self.neighbour_every == 0 and n > 1:
+            nearest = build_knn_candidates(agent_now, 1, param["ax_lim"])["dist"][:, 0]
+            self.record("nearest_neighbour", float(np.mean(nearest)))
+            self.record_agents("nearest_neighbour", nearest)
+
+    def summary(self):
+        '''
+        Last value, mean and standard deviation over the steps of every metric
+
+        Returns
+        -------
+        summary : dict
+            metric -> last value, metric_mean and metric_std.
+
+        '''
+        summary = {}
+        for name, stats in self.stats.items():
+            summary[name] = self.last[name]
+            summary[name + "_mean"] = stats.mean
+            summary[name + "_std"] = stats.std
+
+        return summary
@@ -0,0 +1,273 @@
+import itertools
+import numpy as np
+
+
+def wrap_into_box(positions, ax_lim, out = None):
+    '''
+    Maps positions into the periodic box [lower_lim, upper_lim), by subtracting the number
+    of boxes they lie away from it, such that agents far out are wrapped correctly and
+    agents within the box keep their exact coordinates
+
+    Parameters
+    ----------
+    positions : array (..., d)
+        unwrapped positions.
+    ax_lim : tuple
+        lower and upper limit of the box, equal in every dimension.
+    out : array (..., d), optional
+        array the wrapped positions are written into, not positions itself. The default is
+        None (a new array).
+
+    Returns
+    -------
+    wrapped : array (..., d)
+
+    '''
+    lower_lim, upper_lim = ax_lim
+    box = upper_lim - lower_lim
+    if out is None:
+        out = np.empty_like(positions, dtype = np.result_type(positions, 1.0))
+    np.subtract(positions, lower_lim, out = out)
+    np.divide(out, box, out = out)
+    np.floor(out, out = out)
+    out *= box
+    np.subtract(positions, out, out = out)
+
+    return out
+
+def minimum_image(delta, ax_lim):
+    '''
+    Replaces displacements by the shortest displacement between the periodic images, in place
+    '''
+    lower_lim, upper_lim = ax_lim
+    box = upper_lim - lower_lim
+    delta -= box * np.round(delta / box)
+
+    return delta
+
+def build_cell_list(positions, radius, ax_lim):
+    '''
+    Sorts the agents into a uniform grid of cells with an edge of at least radius, such that
+    all neighbours of an agent lie in its own or the directly adjacent (periodic) cells
+
+    Parameters
+    ----------
+    positions : array (n, d)
+    radius : float
+        neighbour radius.
+    ax_lim : tuple
+        limits of the periodic box.
+
+    Returns
+    -------
+    cells : dict
+        cell index of every agent (n, d), agents sorted by cell (order), first sorted index
+        (start) and number of agents (count) per cell, cells per dimension (m).
+
+    '''
+    lower_lim, upper_lim = ax_lim
+    n, d = positions.shape
+    box = upper_lim - lower_lim
+    m = max(1, int(box // radius))
+    cell_size = box / m
+
+    cell_idx = ((wrap_into_box(positions, ax_lim) - lower_lim) / cell_size).astype(np.intp)
+    np.clip(cell_idx, 0, m - 1, out = cell_idx)
+    flat = np.ravel_multi_index(cell_idx.T, (m,) * d)
+
+    order = np.argsort(flat, kind = "stable")
+    count = np.bincount(flat, minlength = m**d)
+    start = np.cumsum(count) - count
+
+    return {"cell_idx": cell_idx, "order": order, "start": start, "count": count, "m": m}
+
+def cell_offsets(m, d):
+    '''
+    Offsets to the adjacent cells, without visiting a cell twice when there are fewer than three
+    cells per dimension
+    '''
+    offsets_1d = range(-1, 2) if m >= 3 else range(m)
+
+    return np.array(list(itertools.product(offsets_1d, repeat = d)), dtype = np.intp)
+
+def local_center_of_mass(agent_now, radius, ax_lim, max_pairs = 2**22):
+    '''
+    Center of mass of the agents within radius of every agent (the agent itself included),
+    found with cell lists in O(n * agents per cell) instead of O(n^2)
+
+    Parameters
+    ----------
+    agent_now : array (n, d)
+        positions, may lie outside of the box (unwrapped coordinates).
+    radius : float
+        neighbour radius.
+    ax_lim : tuple
+        limits of the periodic box.
+    max_pairs : int, optional
+        maximum number of candidate pairs held in memory at once. The default is 2**22.
+
+    Returns
+    -------
+    C : array (n, d)
+        local centers of mass, in the same (unwrapped) coordinates as agent_now.
+    n_neighbours : array (n,)
+        number of agents within radius, including the agent itself.
+
+    '''
+    lower_lim, upper_lim = ax_lim
+    box = upper_lim - lower_lim
+    n, d = agent_now.shape
+    cells = build_cell_list(agent_now, radius, ax_lim)
+    m, order, start, count = cells["m"], cells["order"], cells["start"], cells["count"]
+
+    # work on the agents sorted by cell, such that the agents of a cell are contiguous
+    agent_sorted = wrap_into_box(agent_now, ax_lim)[order]
+    cell_sorted = cells["cell_idx"][order]
+    delta_sum = np.zeros((n, d))
+    n_neighbours = np.zeros(n)
+    radius_sq = radius**2
+
+    for offset in cell_offsets(m, d):
+        # neighbouring cell of every agent and the periodic image it lies in
+        shifted = cell_sorted + offset
+        image = np.floor_divide(shifted, m)
+        neighbour_cell = np.ravel_multi_index((shifted - image * m).T, (m,) * d)
+        # agents seen from the image of the neighbouring cell
+        agent_image = agent_sorted - box * image
+        n_candidates = count[neighbour_cell]
+        bounds = np.concatenate(([0], np.cumsum(n_candidates)))
+
+        # process the agents in chunks, such that dense cells do not exhaust the memory
+        first = 0
+        while first < n:
+            last = np.searchsorted(bounds, bounds[first] + max_pairs, side = "right") - 1
+            last = min(max(last, first + 1), n)
+            candidates = n_candidates[first:last]
+            group = bounds[first:last] - bounds[first]
+
+            within = np.arange(bounds[last] - bounds[first]) - np.repeat(group, candidates)
+            j = np.repeat(start[neighbour_cell[first:last]], candidates) + within
+
+            delta = agent_sorted[j] - np.repeat(agent_image[first:last], candidates, axis = 0)
+            if m < 3:
+                # adjacent cells do not determine the image when the box holds few cells
+                minimum_image(delta, ax_lim)
+            close = np.einsum("ij,ij->i", delta, delta) <= radius_sq
+            delta *= close[:, None]
+
+            # sum over the contiguous candidates of every agent
+            nonempty = np.flatnonzero(candidates)
+            if len(nonempty):
+                delta_sum[first + nonempty] += np.add.reduceat(delta, group[nonempty], axis = 0)
+                n_neighbours[first + nonempty] += np.add.reduceat(close, group[nonempty])
+            first = last
+
+    # back from the cell order to the order of the agents
+    C = np.empty_like(delta_sum)
+    C[order] = delta_sum / n_neighbours[:, None]
+    C += agent_now
+    n_neighbours[order] = n_neighbours.copy()
+
+    return C, n_neighbours
+
+def build_knn_candidates(agent_now, n_candidates, ax_lim):
+    '''
+    Builds a periodic KD-tree and queries the n_candidates nearest flockmates of every agent
+
+    Parameters
+    ----------
+    agent_now : array (n, d)
+    n_candidates : int
+        number of flockmates kept per agent, more than the k used for steering.
+    ax_lim : tuple
+        limits of the periodic box.
+
+    Returns
+    -------
+    state : dict
+        candidate indices (n, n_candidates), their distances at build time and the reference
+        positions the tree was built from.
+
+    '''
+    # scipy is only imported for the knn interaction, it slows down the start of every other run
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        raise ImportError("The knn interaction requires scipy.")
+    lower_lim, upper_lim = ax_lim
+    box = upper_lim - lower_lim
+    wrapped = wrap_into_box(agent_now, ax_lim) - lower_lim
+    # rounding can map a coordinate onto the upper edge, which the periodic tree rejects
+    wrapped[wrapped >= box] = 0
+    tree = cKDTree(wrapped, boxsize = box)
+    n_query = min(n_candidates + 1, len(agent_now))
+    dist, idx = tree.query(wrapped, k = n_query)
+
+    # the first hit of every agent is the agent itself
+    return {"candidates": idx[:, 1:], "dist": dist[:, 1:], "reference": agent_now.copy()}
+
+def knn_center_of_mass(agent_now, k, ax_lim, state, extra = None):
+    '''
+    Center of mass of the k nearest flockmates of every agent. The KD-tree is only rebuilt when
+    the agents moved far enough that a flockmate outside the stored candidates could have
+    become one of the k nearest (Verlet skin). Common translations of the flock and, while it
+    spans less than half the box, common dilations do not count. In this model the flock
+    expands with the velocities of its first step, hence the tree is kept while the flock is
+    small against the box and the center pull bends the paths by less than the skin (e.g.
+    center_pull 0.001 from init_coord (-1, 1)). A flock spanning the box, or a strong pull,
+    rebuilds it in every step.
+
+    Parameters
+    ----------
+    agent_now : array (n, d)
+        positions, may lie outside of the box (unwrapped coordinates).
+    k : int
+        number of nearest flockmates.
+    ax_lim : tuple
+        limits of the periodic box.
+    state : dict
+        candidate lists of the last build, updated in place. Pass an empty dict to start.
+    extra : int, optional
+        candidates stored beyond the k nearest (param["knn_extra"] of the engine), a larger
+        skin means fewer rebuilds but more work per step. The default is k.
+
+    Returns
+    -------
+    C : array (n, d)
+        local centers of mass, in the same (unwrapped) coordinates as agent_now.
+
+    '''
+    n, d = agent_now.shape
+    k = min(k, n - 1)
+    extra = k if extra is None else extra
+
+    stale = "candidates" not in state
+    if not stale:
+        # a common translation of the flock leaves all distances unchanged, hence the distance
+        # of i to j changed by at most the displacements of i and j relative to the mean
+        reference = state["reference"] - np.mean(state["reference"], axis = 0)
+        moved = agent_now - state["reference"]
+        moved -= np.mean(moved, axis = 0)
+        scale = 1.0
+        lower_lim, upper_lim = ax_lim
+        if max(np.ptp(agent_now, axis = 0).max(), np.ptp(state["reference"], axis = 0).max()) < (upper_lim - lower_lim) / 2:
+            # a flock within half the box has no periodic images among its nearest flockmates,
+            # and a common dilation (e.g. the expansion from the initial velocities) keeps the
+            # order of all distances, only the displacements around it count, shrunk by scale
+            scale = 1 + np.einsum("ij,ij->", reference, moved) / np.einsum("ij,ij->", reference, reference)
+            moved -= (scale - 1) * reference
+        moved = np.sqrt(np.einsum("ij,ij->i", moved, moved))
+        margin = state["dist"][:, -1] - state["dist"][:, k - 1]
+        stale = scale <= 0 or np.any(scale * margin < 2 * (moved + np.max(moved)))
+    if stale:
+        state.update(build_knn_candidates(agent_now, k + extra, ax_lim))
+        state["n_builds"] = state.get("n_builds", 0) + 1
+
+    # current displacements to the candidates, of which the k nearest are kept
+    delta = minimum_image(agent_now[state["candidates"]] - agent_now[:, None, :], ax_lim)
+    if delta.shape[1] > k:
+        dist = np.einsum("ijk,ijk->ij", delta, delta)
+        nearest = np.argpartition(dist, k - 1, axis = 1)[:, :k]
+        delta = np.take_along_axis(delta, nearest[:, :, None], axis = 1)
+
+    return agent_now + np.mean(delta, axis = 1)
@@ -0,0 +1,127 @@
+import numpy as np
+from flocking_engine import allocate_buffers, center_of_mass, euclidian_dist, needs_wrap
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel = True, cache = True)
+    def mean_numba(agent_now, n_chunks):
+        '''
+        Center of mass with one partial sum per chunk of agents, chunks run in parallel
+        '''
+        n, d = agent_now.shape
+        chunk = (n + n_chunks - 1) // n_chunks
+        partial = np.zeros((n_chunks, d))
+        for c in prange(n_chunks):
+            for i in range(c * chunk, min(n, (c + 1) * chunk)):
+                for j in range(d):
+                    partial[c, j] += agent_now[i, j]
+        C = np.zeros(d)
+        for c in range(n_chunks):
+            for j in range(d):
+                C[j] += partial[c, j]
+
+        return C / n
+
+    @njit(parallel = True, cache = True)
+    def step_numba(agent_now, agent_old, C, center_pull, predator_xy, predator_push,
+                   lower_lim, upper_lim, wrap, agent_temp, agent_plot, dist_center, dist_predator):
+        '''
+        Fused position-Verlet step: center pull, predator push and, if wrap, periodic
+        boundaries of every agent in one pass, parallel over the agents. C is (1, d) for a
+        global or (n, d) for a local center of mass, predator_xy has one row per predator (none
+        without predator). The distances to the center of mass and to the nearest predator are
+        written into dist_center and dist_predator.
+        '''
+        n, d = agent_now.shape
+        n_predators = predator_xy.shape[0]
+        box = upper_lim - lower_lim
+        # row step of C, 0 repeats the global center of mass for every agent
+        row_step = 1 if C.shape[0] > 1 else 0
+        for i in prange(n):
+            row = np.int64(i) * row_step
+            center_sq = 0.0
+            for j in range(d):
+                delta = C[row, j] - agent_now[i, j]
+                center_sq += delta * delta
+            center = np.sqrt(center_sq)
+            dist_center[i] = center
+            # agents sitting on their target feel no pull
+            scale_center = center_pull / center if center > 0 else 0.0
+
+            for j in range(d):
+                agent_temp[i, j] = 2 * agent_now[i, j] - agent_old[i, j] + scale_center * (C[row, j] - agent_now[i, j])
+            nearest = np.inf
+            for m in range(n_predators):
+                predator_sq = 0.0
+                for j in range(d):
+                    delta = predator_xy[m, j] - agent_now[i, j]
+                    predator_sq += delta * delta
+                predator = np.sqrt(predator_sq)
+                nearest = min(nearest, predator)
+                scale_predator = predator_push / predator if predator > 0 else 0.0
+                for j in range(d):
+                    agent_temp[i, j] += scale_predator * (predator_xy[m, j] - agent_now[i, j])
+            if n_predators:
+                dist_predator[i] = nearest
+
+            if wrap:
+                for j in range(d):
+                    x = agent_temp[i, j]
+                    # same modulo as flocking_neighbours.wrap_into_box
+                    if x < lower_lim or x >= upper_lim:
+                        agent_plot[i, j] = x - np.floor((x - lower_lim) / box) * box
+                    else:
+                        agent_plot[i, j] = x
+
+def update(agent_now, agent_old, param, buffers = None):
+    '''
+    Compiled counterpart of flocking_engine.update, with the same arguments and results
+    '''
+    if buffers is None:
+        buffers = allocate_buffers(*agent_now.shape, dtype = agent_now.dtype)
+    lower_lim, upper_lim = param["ax_lim"]
+    wrap = needs_wrap(param, buffers)
+    if param.get("interaction", "global") == "global":
+        C = mean_numba(agent_now, numba.get_num_threads())
+    else:
+        C = center_of_mass(agent_now, param)
+    buffers["C"] = C
+
+    step_numba(agent_now, agent_old, np.atleast_2d(C), param["center_pull"], np.empty((0, agent_now.shape[1])), 0.0,
+               lower_lim, upper_lim, wrap, buffers["agent_temp"], buffers["agent_plot"], buffers["dist_center"],
+               buffers["dist"])
+
+    return buffers["agent_temp"], buffers["agent_plot"] if wrap else buffers["agent_temp"], param
+
+def update_predator(agent_now, agent_old, param, buffers = None):
+    '''
+    Compiled counterpart of flocking_engine.update_predator, with the same arguments and results
+    '''
+    if buffers is None:
+        buffers = allocate_buffers(*agent_now.shape, dtype = agent_now.dtype)
+    lower_lim, upper_lim = param["ax_lim"]
+    wrap = needs_wrap(param, buffers)
+    predator_xy = param["predator_xy"]
+    # the predator always follows the whole flock
+    C = mean_numba(agent_now, numba.get_num_threads())
+    C_agents = C if param.get("interaction", "global") == "global" else center_of_mass(agent_now, param)
+    buffers["C"] = C_agents
+    if "dist_predator" not in buffers:
+        buffers["dist_predator"] = np.empty_like(buffers["dist"])
+
+    step_numba(agent_now, agent_old, np.atleast_2d(C_agents), param["center_pull"], np.atleast_2d(predator_xy),
+               param["predator_push"], lower_lim, upper_lim, wrap, buffers["agent_temp"], buffers["agent_plot"],
+               buffers["dist_center"], buffers["dist_predator"])
+
+    # predators are placed at predator_pull from the origin, in their direction from the
+    # center of mass of this step
+    predator_xy[:] = param["predator_pull"] * (predator_xy - C) / euclidian_dist((predator_xy - C), axis = -1)[..., None]
+
+    return buffers["agent_temp"], buffers["agent_plot"] if wrap else buffers["agent_temp"], param
@@ -0,0 +1,191 @@
+import os
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from flocking_trajectory import open_trajectory
+
+
+def panel_figure(titles, d, ax_lims = 50, pointsize = 2):
+    '''
+    Figure with one scatter panel per simulation, side by side, on its own Agg canvas (no
+    pyplot, such that every worker process can draw its own)
+
+    Parameters
+    ----------
+    titles : list of str
+        title of every panel.
+    d : int
+        number of dimensions, 2 or 3.
+    ax_lims : float, optional
+        the panels show [-ax_lims, ax_lims]**d. The default is 50.
+    pointsize : float, optional
+        The default is 2.
+
+    Returns
+    -------
+    fig : Figure
+    lines : list of PathCollection
+        the scatter of every panel.
+
+    '''
+    ncol = len(titles)
+    fig = Figure(figsize = (ncol * 6, 6))
+    FigureCanvasAgg(fig)
+    lines = []
+    for i, title in enumerate(titles):
+        if d == 2:
+            ax = fig.add_subplot(1, ncol, i + 1)
+            line = ax.scatter([], [], s = pointsize)
+        elif d == 3:
+            ax = fig.add_subplot(1, ncol, i + 1, projection = '3d')
+            line = ax.scatter([], [], [], s = pointsize)
+            ax.set_zlim3d([-ax_lims, ax_lims])
+        else:
+            raise ValueError("Please simulate in 2 or 3 dimensions to animate!")
+        ax.set_title(title)
+        ax.set_xlim([-ax_lims, ax_lims])
+        ax.set_ylim([-ax_lims, ax_lims])
+        lines.append(line)
+
+    return fig, lines
+
+def set_frame(lines, frame):
+    '''
+    Moves the scatter of every panel to the positions (n, d) of its simulation in frame
+    '''
+    for line, positions in zip(lines, frame):
+        positions = np.asarray(positions)
+        if positions.shape[1] == 2:
+            line.set_offsets(positions)
+        else:
+            line._offsets3d = (positions[:, 0], positions[:, 1], positions[:, 2])
+
+def draw_rgb(fig):
+    '''
+    Draws the figure and returns its pixels as raw RGB bytes
+    '''
+    fig.canvas.draw()
+
+    return np.asarray(fig.canvas.buffer_rgba())[:, :, :3].tobytes()
+
+# figure of a worker process, built once by its initializer
+_worker_figure = None
+
+def _init_worker(titles, d, ax_lims, pointsize):
+    global _worker_figure
+    _worker_figure = panel_figure(titles, d, ax_lims, pointsize)
+
+def _render_chunk(frames):
+    '''
+    Renders a chunk of frames in a worker process
+
+    Parameters
+    ----------
+    frames : list of array (ncol, n, d)
+        positions of every simulation in every frame of the chunk.
+
+    Returns
+    -------
+    pixels : list of bytes
+        raw RGB image of every frame.
+
+    '''
+    fig, lines = _worker_figure
+    pixels = []
+    for frame in frames:
+        set_frame(lines, frame)
+        pixels.append(draw_rgb(fig))
+
+    return pixels
+
+def ffmpeg_command(filename, width, height, fps):
+    '''
+    ffmpeg reading raw RGB frames of width x height from stdin and encoding them as H.264.
+    The executable is the one matplotlib uses, rcParams["animation.ffmpeg_path"].
+    '''
+    return [matplotlib.rcParams["animation.ffmpeg_path"], "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+            # yuv420p needs even dimensions
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-vcodec", "libx264", "-pix_fmt", "yuv420p", filename]
+
+def render_video(simulation_list, titles, filename, ax_lims = 50, pointsize = 2, fps = 20, workers = None,
+                 chunk_frames = 8):
+    '''
+    Renders simulations side by side into a video. Chunks of frames are drawn by a pool of
+    processes, each on its own Agg canvas, and their pixels are written in order into a
+    single ffmpeg pipe. Only the chunks in flight are held in memory.
+
+    Parameters
+    ----------
+    simulation_list : list
+        arrays (steps+1, n, d), memory maps or filenames of stored trajectories.
+    titles : list of str
+    filename : str
+        video file, e.g. "animations/example.mp4".
+    ax_lims : float, optional
+        The default is 50.
+    pointsize : float, optional
+        The default is 2.
+    fps : float, optional
+        frames per second of the video. The default is 20.
+    workers : int, optional
+        number of rendering processes, 1 renders in this process. The default is None (all cores).
+    chunk_frames : int, optional
+        frames per task of a worker. The default is 8.
+
+    '''
+    simulation_list = [open_trajectory(simulation) for simulation in simulation_list]
+    n_frames = simulation_list[0].shape[0]
+    if not all(x.shape[0] == n_frames for x in simulation_list):
+        raise RuntimeError("All simulation must have been simulated with same number of steps")
+    d = simulation_list[0].shape[2]
+    workers = (os.cpu_count() or 1) if workers is None else workers
+
+    # the size of the video is the one of the figure, which every worker builds alike
+    fig, lines = panel_figure(titles, d, ax_lims, pointsize)
+    width, height = fig.canvas.get_width_height(physical = True)
+
+    def chunks():
+        # only the frames of a chunk are read from the trajectories
+        for start in range(0, n_frames, chunk_frames):
+            stop = min(start + chunk_frames, n_frames)
+            stack = [np.asarray(simulation[start:stop]) for simulation in simulation_list]
+            yield [[positions[j] for positions in stack] for j in range(stop - start)]
+
+    process = subprocess.Popen(ffmpeg_command(filename, width, height, fps),
+                               stdin = subprocess.PIPE, stderr = subprocess.PIPE)
+    try:
+        if workers == 1:
+            for frames in chunks():
+                for frame in frames:
+                    set_frame(lines, frame)
+                    process.stdin.write(draw_rgb(fig))
+        else:
+            with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker,
+                                     initargs = (titles, d, ax_lims, pointsize)) as executor:
+                # a window of chunks in flight keeps the workers busy, and the memory bounded
+                # while ffmpeg encodes, the chunks are written in the order they were submitted
+                pending = deque()
+                for frames in chunks():
+                    pending.append(executor.submit(_render_chunk, frames))
+                    if len(pending) >= 2 * workers:
+                        process.stdin.writelines(pending.popleft().result())
+                while pending:
+                    process.stdin.writelines(pending.popleft().result())
+    except BrokenPipeError:
+        # ffmpeg stopped early, its error is raised below
+        pass
+    finally:
+        # ffmpeg finishes the video once its input is closed, also when rendering failed
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        error = process.stderr.read()
+        process.wait()
+    if process.returncode:
+        raise RuntimeError(f"ffmpeg failed to write {filename}: {error.decode(errors = 'replace')}")
@@ -0,0 +1,169 @@
+import os
+import numpy as np
+from flocking_trajectory import open_trajectory, read_metadata
+from flocking_sweep import frame_metrics, table_from_rows
+
+# metrics of load_metrics, the last two from the displacement since the frame before
+FRAME_METRICS = ("cohesion_radius", "mean_speed", "polarization")
+VELOCITY_METRICS = ("mean_speed", "polarization")
+
+
+def index_runs(directory):
+    '''
+    Indexes the stored trajectories in directory (e.g. the trajectory_dir of run_sweep) by
+    their parameters. Only the json metadata next to every trajectory is read.
+
+    Parameters
+    ----------
+    directory : str
+
+    Returns
+    -------
+    index : dict
+        column name -> array, one row per run: file, n_frames, stride and the scalar
+        parameters of the run (with its seed for runs of run_sweep). Rows are selected with
+        masks of the columns, e.g. index["center_pull"] > 1.
+
+    '''
+    rows = []
+    for name in sorted(os.listdir(directory)):
+        filename = os.path.join(directory, name)
+        metadata = read_metadata(filename)
+        if metadata is None or not os.path.exists(filename):
+            continue
+        row = {"file": filename, "n_frames": metadata["n_frames"], "stride": metadata["stride"]}
+        row.update((key, value) for key, value in metadata["param"].items() if np.isscalar(value))
+        rows.append(row)
+
+    return table_from_rows(rows)
+
+def select_runs(index, runs):
+    '''
+    Row numbers of the runs of index, runs is None (all runs), a boolean mask or row numbers
+    '''
+    rows = np.arange(len(index["file"]))
+
+    return rows if runs is None else rows[runs]
+
+def run_geometry(filename):
+    '''
+    Stride and periodic box (None without periodic boundaries) of a stored run
+    '''
+    metadata = read_metadata(filename)
+    param = metadata["param"]
+    ax_lim = tuple(param["ax_lim"]) if param.get("periodic", True) else None
+
+    return metadata["stride"], ax_lim
+
+def param_columns(index, params, run, count):
+    '''
+    The values of the parameters params of run, repeated for count rows
+    '''
+    return {key: np.repeat(index[key][run], count) for key in params}
+
+def concatenate_columns(parts, columns):
+    return {column: np.concatenate([part[column] for part in parts]) if parts else np.array([])
+            for column in columns}
+
+def load_metrics(index, metrics = FRAME_METRICS, frames = slice(None), runs = None, params = (), block_frames = 256):
+    '''
+    Per frame metrics of many stored runs in one columnar table. Only the requested frames
+    (and, for the velocity metrics, the frames before them) are read from the memory mapped
+    or delta trajectories, in blocks of frames, such that no trajectory is loaded as a whole.
+
+    Parameters
+    ----------
+    index : dict
+        from index_runs.
+    metrics : sequence of str, optional
+        columns of FRAME_METRICS, see flocking_sweep.frame_metrics. The default is all of them.
+    frames : slice or array, optional
+        frames of every run, e.g. slice(-10, None) for the last ten. The default is all frames.
+    runs : array, optional
+        boolean mask or row numbers of the runs in index. The default is None (all runs).
+    params : sequence of str, optional
+        columns of index added to every row, e.g. ("center_pull", "seed"). The default is ().
+    block_frames : int, optional
+        frames read at once. The default is 256.
+
+    Returns
+    -------
+    table : dict
+        column name -> array, one row per run and frame: run (row of index), frame, step,
+        params and metrics. The velocity metrics of frame 0 are nan.
+
+    '''
+    unknown = set(metrics) - set(FRAME_METRICS)
+    if unknown:
+        raise ValueError(f"Unknown metrics {', '.join(sorted(unknown))}. Choose from {', '.join(FRAME_METRICS)}.")
+    velocity = any(metric in VELOCITY_METRICS for metric in metrics)
+    parts = []
+    for run in select_runs(index, runs):
+        filename = index["file"][run]
+        stride, ax_lim = run_geometry(filename)
+        positions = open_trajectory(filename)
+        selected = np.arange(len(positions))[frames]
+        for start in range(0, len(selected), block_frames):
+            block = selected[start:start + block_frames]
+            if velocity:
+                # the frames and the ones before them are read at once, every frame once
+                needed, inverse = np.unique(np.concatenate([block, np.maximum(block - 1, 0)]), return_inverse = True)
+                read = np.asarray(positions[needed], dtype = np.float64)
+                current, previous = read[inverse[:len(block)]], read[inverse[len(block):]]
+            else:
+                current, previous = np.asarray(positions[block], dtype = np.float64), None
+            values = frame_metrics(current, previous, ax_lim, stride, metrics)
+            for metric in VELOCITY_METRICS:
+                if metric in values:
+                    values[metric][block == 0] = np.nan
+            parts.append({"run": np.full(len(block), run), "frame": block, "step": block * stride,
+                          **param_columns(index, params, run, len(block)),
+                          **{metric: values[metric] for metric in metrics}})
+
+    return concatenate_columns(parts, ["run", "frame", "step", *params, *metrics])
+
+def load_positions(index, frames = slice(None), agents = slice(None), runs = None, params = ()):
+    '''
+    Subsampled positions of many stored runs in one columnar table (long format), only the
+    requested frames are read
+
+    Parameters
+    ----------
+    index : dict
+        from index_runs.
+    frames : slice or array, optional
+        frames of every run, e.g. slice(None, None, 10). The default is all frames.
+    agents : slice or array, optional
+        agents of every frame, e.g. slice(None, None, 100). The default is all agents.
+    runs : array, optional
+        boolean mask or row numbers of the runs in index. The default is None (all runs).
+    params : sequence of str, optional
+        columns of index added to every row. The default is ().
+
+    Returns
+    -------
+    table : dict
+        column name -> array, one row per run, frame and agent: run, frame, step, agent,
+        params and the coordinates x, y (and z).
+
+    '''
+    parts = []
+    axes = ("x", "y", "z")
+    d = 0
+    for run in select_runs(index, runs):
+        filename = index["file"][run]
+        stride = read_metadata(filename)["stride"]
+        positions = open_trajectory(filename)
+        n_frames, n, d = positions.shape
+        selected = np.arange(n_frames)[frames]
+        chosen = np.arange(n)[agents]
+        # (frames, agents, d), with the agents subsampled while reading
+        read = np.asarray(positions[selected[:, None], chosen[None, :]] if isinstance(positions, np.ndarray)
+                          else positions[selected][:, chosen])
+        count = read.shape[0] * read.shape[1]
+        parts.append({"run": np.full(count, run), "frame": np.repeat(selected, len(chosen)),
+                      "step": np.repeat(selected * stride, len(chosen)), "agent": np.tile(chosen, len(selected)),
+                      **param_columns(index, params, run, count),
+                      **{axes[j]: read[:, :, j].reshape(-1) for j in range(d)}})
+
+    return concatenate_columns(parts, ["run", "frame", "step", "agent", *params, *axes[:d]])
@@ -0,0 +1,177 @@
+import os
+import csv
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+def expand_grid(base_param, grid):
+    '''
+    Builds one param dict per combination of the values in grid
+
+    Parameters
+    ----------
+    base_param : dict
+        parameters shared by all runs.
+    grid : dict
+        parameter name -> list of values, e.g. {"center_pull": [0.5, 1.5], "n": [100, 1000]}.
+
+    Returns
+    -------
+    param_list : list of dict
+
+    '''
+    keys = list(grid)
+
+    return [{**base_param, **dict(zip(keys, values))} for values in itertools.product(*(grid[key] for key in keys))]
+
+def frame_metrics(current, previous, ax_lim, stride = 1, metrics = ("cohesion_radius", "mean_speed", "polarization")):
+    '''
+    Metrics of stored frames, vectorized over the frames. Displacements use the shortest
+    periodic image, such that flocks crossing the boundary are measured correctly.
+
+    Parameters
+    ----------
+    current : array (frames, n, d)
+    previous : array (frames, n, d) or None
+        positions of the frame before every frame, needed for mean_speed and polarization.
+    ax_lim : tuple or None
+        limits of the periodic box, None for runs without periodic boundaries.
+    stride : int, optional
+        steps between the frames, speeds are per step. The default is 1.
+    metrics : sequence of str, optional
+        cohesion_radius (rms distance to the center of mass), mean_speed and polarization
+        (norm of the mean direction of motion, 1 for a perfectly aligned flock).
+
+    Returns
+    -------
+    metrics : dict
+        metric -> array (frames,).
+
+    '''
+    from flocking_neighbours import minimum_image
+
+    def shortest(delta):
+        return delta if ax_lim is None else minimum_image(delta, ax_lim)
+
+    result = {}
+    if "cohesion_radius" in metrics:
+        # center of mass relative to the first agent, which is unaffected by the periodic boundaries
+        delta = shortest(current - current[:, :1])
+        delta -= np.mean(delta, axis = 1, keepdims = True)
+        result["cohesion_radius"] = np.sqrt(np.mean(np.sum(delta**2, axis = 2), axis = 1))
+    if "mean_speed" in metrics or "polarization" in metrics:
+        velocity = shortest(current - previous) / stride
+        speed = np.sqrt(np.sum(velocity**2, axis = 2))
+        if "mean_speed" in metrics:
+            result["mean_speed"] = np.mean(speed, axis = 1)
+        if "polarization" in metrics:
+            moving = speed > 0
+            np.divide(velocity, speed[..., None], out = velocity, where = moving[..., None])
+            velocity *= moving[..., None]
+            direction = np.sum(velocity, axis = 1) / np.maximum(np.count_nonzero(moving, axis = 1), 1)[:, None]
+            result["polarization"] = np.sqrt(np.sum(direction**2, axis = 1))
+
+    return result
+
+def table_from_rows(rows):
+    '''
+    Columnar table of a list of row dicts, with the union of their columns in order of
+    appearance (None where a row misses a column)
+    '''
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+
+    return {column: np.array([row.get(column) for row in rows]) for column in columns}
+
+def _run_task(task):
+    '''
+    Runs a single simulation of the sweep in a worker process
+    '''
+    # the headless engine is all a worker needs, matplotlib is never imported
+    from flocking_engine import run_simulation
+    from flocking_metrics import FlockMetrics
+
+    index, param, seed, mode, d, burn_in, trajectory_file, stride, trajectory_precision = task
+    # metrics are computed during the run, the trajectory is only stored if asked for
+    metrics = FlockMetrics(burn_in = burn_in)
+    # the seed is kept with the parameters in the metadata of the trajectory, see flocking_runs
+    param = dict(param) if trajectory_file is None else dict(param, seed = seed)
+    # the stream belongs to the task, not to the worker, results do not depend on the pool
+    run_simulation(mode = mode, d = d, param = param, store_positions = False, metrics = [metrics],
+                   trajectory_file = trajectory_file, stride = stride, trajectory_precision = trajectory_precision,
+                   rng = np.random.SeedSequence(seed))
+
+    return index, metrics.summary()
+
+def run_sweep(param_list, seeds = (0,), mode = "basic", d = 2, max_workers = None, burn_in = 0,
+              trajectory_dir = None, stride = 1, trajectory_precision = None):
+    '''
+    Runs every param dict with every seed on a pool of processes, with the headless engine,
+    and collects the summary metrics of all runs in one table
+
+    Parameters
+    ----------
+    param_list : list of dict
+        parameters of the runs, e.g. from expand_grid.
+    seeds : sequence of int, optional
+        seeds of the replicates of every param dict, each run draws from its own stream
+        np.random.SeedSequence(seed). Runs with the same seed start alike for every param dict
+        (common random numbers), and the table is the same for any number of workers. The
+        default is (0,).
+    mode : str, optional
+        simulation mode, see simulate_flocking. The default is "basic".
+    d : int, optional
+        number of dimensions. The default is 2.
+    max_workers : int, optional
+        number of processes. The default is None (all cores).
+    burn_in : int, optional
+        steps before the metrics are recorded. The default is 0.
+    trajectory_dir : str, optional
+        store the trajectory of every run in this directory, as run_<index>.npy (or .dtz for
+        delta trajectories), to be loaded with flocking_runs. The default is None.
+    stride : int, optional
+        store every stride-th step. The default is 1.
+    trajectory_precision : float, optional
+        store delta trajectories with this precision, see run_simulation. The default is None.
+
+    Returns
+    -------
+    table : dict
+        column name -> array, one row per run. Holds the scalar parameters, the seed, the
+        summary of FlockMetrics (last value, mean and standard deviation of every metric) and
+        with trajectory_dir the trajectory_file of every run.
+
+    '''
+    if trajectory_dir is not None:
+        os.makedirs(trajectory_dir, exist_ok = True)
+    extension = ".npy" if trajectory_precision is None else ".dtz"
+
+    def trajectory_file(index):
+        return None if trajectory_dir is None else os.path.join(trajectory_dir, f"run_{index:05d}{extension}")
+
+    tasks = [(index, param, seed, mode, d, burn_in, trajectory_file(index), stride, trajectory_precision)
+             for index, (param, seed) in enumerate(itertools.product(param_list, seeds))]
+    results = [None] * len(tasks)
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        for index, summary in executor.map(_run_task, tasks, chunksize = max(1, len(tasks) // (4 * (os.cpu_count() or 1)))):
+            results[index] = summary
+
+    rows = []
+    for (index, param, seed, mode, d, burn_in, filename, stride, trajectory_precision), summary in zip(tasks, results):
+        row = {key: value for key, value in param.items() if np.isscalar(value)}
+        row = {**row, "seed": seed, **summary}
+        if filename is not None:
+            row["trajectory_file"] = filename
+        rows.append(row)
+
+    return table_from_rows(rows)
+
+def save_table(table, filename):
+    '''
+    Writes a table of run_sweep to a csv file
+    '''
+    columns = list(table)
+    with open(filename, "w", newline = "") as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        writer.writerows(zip(*(table[column] for column in columns)))
@@ -0,0 +1,536 @@
+import os
+import json
+import zlib
+import queue
+import struct
+import threading
+import numpy as np
+
+
+def metadata_filename(filename):
+    '''
+    Name of the json file next to a trajectory, holding its stride and parameters
+    '''
+    return filename + ".json"
+
+# state the engine keeps in param during a run, it is not a parameter of the run
+RUNTIME_KEYS = ("knn_state",)
+
+def jsonable_param(param):
+    '''
+    Keeps the parameters that can be written to json (numbers, strings, tuples and arrays)
+    '''
+    jsonable = {}
+    for key, value in param.items():
+        if key in RUNTIME_KEYS:
+            continue
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        try:
+            json.dumps(value)
+        except TypeError:
+            continue
+        jsonable[key] = value
+
+    return jsonable
+
+def write_metadata(filename, stride, n_frames, param, **extra):
+    '''
+    Writes the stride, number of frames and parameters of a trajectory into the json file next to it
+    '''
+    with open(metadata_filename(filename), "w") as file:
+        json.dump({"stride": stride, "n_frames": n_frames, "param": jsonable_param(param or {}), **extra}, file)
+
+class TrajectoryWriter:
+    '''
+    Streams the positions of a simulation into a .npy file, every stride-th step is stored.
+    The file is memory mapped and flushed in chunks of frames, such that the memory use does
+    not grow with the number of steps.
+
+    Parameters
+    ----------
+    filename : str
+        .npy file to write.
+    n : int
+        number of agents.
+    d : int
+        number of dimensions.
+    steps : int
+        number of simulation steps, the initial positions are step 0.
+    stride : int, optional
+        store every stride-th step. The default is 1.
+    dtype : data type, optional
+        dtype of the stored positions. The default is np.float32.
+    chunk_frames : int, optional
+        number of frames written before the file is flushed. The default is 64.
+    param : dict, optional
+        parameters of the simulation, stored in the json file next to the trajectory.
+    resume : bool, optional
+        continue writing into an existing file of a resumed simulation. The default is False.
+
+    '''
+    def __init__(self, filename, n, d, steps, stride = 1, dtype = np.float32, chunk_frames = 64, param = None,
+                 resume = False):
+        self.filename = filename
+        self.stride = stride
+        self.chunk_frames = chunk_frames
+        self.n_frames = steps // stride + 1
+        self.frames_written = 0
+        if resume:
+            self.positions = np.lib.format.open_memmap(filename, mode = "r+")
+            self.dtype = self.positions.dtype
+            return
+        self.positions = np.lib.format.open_memmap(filename, mode = "w+", dtype = dtype,
+                                                   shape = (self.n_frames, n, d))
+        self.dtype = self.positions.dtype
+
+        write_metadata(filename, stride, self.n_frames, param)
+
+    def write(self, step, positions):
+        '''
+        Stores the positions of step if it is a multiple of the stride
+        '''
+        if step % self.stride:
+            return
+        frame = step // self.stride
+        if frame >= self.n_frames:
+            raise IndexError(f"Step {step} lies beyond the {self.n_frames} frames of {self.filename}.")
+        self.positions[frame] = positions
+        self.frames_written = frame + 1
+        if self.frames_written % self.chunk_frames == 0:
+            self.positions.flush()
+
+    def wants_frame(self, i):
+        # only the stored steps are wrapped by the engine
+        return (i + 1) % self.stride == 0
+
+    def __call__(self, i, agent_plot, param):
+        # observer of the engine, called after step i which yields step i+1
+        self.write(i + 1, agent_plot)
+
+    def flush(self):
+        '''
+        Writes the frames so far to disk
+        '''
+        self.positions.flush()
+
+    def close(self):
+        '''
+        Flushes the remaining frames and releases the memory map
+        '''
+        if self.positions is not None:
+            self.positions.flush()
+            self.positions = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# delta trajectory files: a json header after DELTA_MAGIC, then one record per chunk of frames,
+# a record header (first frame, number of frames, bytes) followed by the compressed chunk
+DELTA_MAGIC = b"FLOCKDTZ"
+DELTA_RECORD = struct.Struct("<qii")
+
+def int_dtype(low, high):
+    '''
+    Smallest signed integer type holding all values in [low, high]
+    '''
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+
+    return np.dtype(np.int64)
+
+def pack_ints(values):
+    '''
+    Integers in their smallest type, with the bytes of equal significance stored together
+    (byte planes), such that the mostly zero high bytes of small deltas compress well
+    '''
+    dtype = int_dtype(values.min(), values.max()) if values.size else np.dtype(np.int8)
+    values = values.astype(dtype.newbyteorder("<"))
+    planes = values.reshape(-1).view(np.uint8).reshape(-1, values.itemsize).T
+
+    return struct.pack("<B", values.itemsize) + planes.tobytes()
+
+def unpack_ints(data, size):
+    '''
+    Reverses pack_ints for size integers, returns them as int64 and the remaining data
+    '''
+    itemsize = data[0]
+    end = 1 + itemsize * size
+    planes = np.frombuffer(data, dtype = np.uint8, count = itemsize * size, offset = 1).reshape(itemsize, size)
+    values = np.ascontiguousarray(planes.T).view(np.dtype(f"<i{itemsize}")).reshape(-1)
+
+    return values.astype(np.int64), data[end:]
+
+class DeltaTrajectoryWriter:
+    '''
+    Streams the positions of a simulation into a compressed delta trajectory, every stride-th
+    step is stored. Positions are quantized to precision * (upper_lim - lower_lim) of the box
+    param["ax_lim"], the maximal error is half of it. Every chunk of frames starts with a key
+    frame and the delta to the next frame, followed by the second differences of the frames,
+    which are the accelerations of the Verlet steps and small for a flock (except for agents
+    crossing the boundary). Chunks are compressed on their own, any frame is read by decoding
+    its chunk only, see DeltaTrajectory. Records are appended, a chunk cut off by a crash is
+    ignored by the reader.
+
+    Parameters
+    ----------
+    filename, n, d, steps, stride, dtype, chunk_frames, param, resume
+        as for TrajectoryWriter, dtype is the one the positions are read back in and
+        chunk_frames the number of frames per compressed chunk.
+    precision : float, optional
+        quantization step relative to the width of the box. The default is 1e-4.
+    compression : int, optional
+        zlib level of the chunks. The default is 6.
+
+    '''
+    def __init__(self, filename, n, d, steps, stride = 1, dtype = np.float32, chunk_frames = 64, param = None,
+                 resume = False, precision = 1e-4, compression = 6):
+        self.filename = filename
+        self.stride = stride
+        self.chunk_frames = chunk_frames
+        self.n_frames = steps // stride + 1
+        self.frames_written = 0
+        self.compression = compression
+        if resume:
+            header, records, end = read_delta_records(filename)
+            self.file = open(filename, "r+b")
+            # a record cut off by a crash is overwritten
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            lower_lim, upper_lim = (param or {})["ax_lim"]
+            header = {"n": n, "d": d, "n_frames": self.n_frames, "dtype": np.dtype(dtype).name,
+                      "origin": lower_lim, "quantum": precision * (upper_lim - lower_lim)}
+            self.file = open(filename, "wb")
+            encoded = json.dumps(header).encode()
+            self.file.write(DELTA_MAGIC + struct.pack("<i", len(encoded)) + encoded)
+            write_metadata(filename, stride, self.n_frames, param, format = "delta", precision = precision)
+        self.dtype = np.dtype(header["dtype"])
+        self.origin = header["origin"]
+        self.quantum = header["quantum"]
+        self.chunk = np.empty((chunk_frames, header["n"], header["d"]), dtype = np.int64)
+        self.chunk_start = 0
+        self.chunk_count = 0
+
+    def write(self, step, positions):
+        '''
+        Stores the positions of step if it is a multiple of the stride
+        '''
+        if step % self.stride:
+            return
+        frame = step // self.stride
+        if frame >= self.n_frames:
+            raise IndexError(f"Step {step} lies beyond the {self.n_frames} frames of {self.filename}.")
+        if self.chunk_count and frame != self.chunk_start + self.chunk_count:
+            # a chunk holds consecutive frames
+            self.write_chunk()
+        if self.chunk_count == 0:
+            self.chunk_start = frame
+        quantized = self.chunk[self.chunk_count]
+        np.rint((np.asarray(positions, dtype = np.float64) - self.origin) / self.quantum, out = quantized,
+                casting = "unsafe")
+        self.chunk_count += 1
+        self.frames_written = frame + 1
+        if self.chunk_count == self.chunk_frames:
+            self.write_chunk()
+
+    def write_chunk(self):
+        '''
+        Compresses the key frame and the deltas of the frames of the chunk, appends them as one record
+        '''
+        if self.chunk_count == 0:
+            return
+        frames = self.chunk[:self.chunk_count]
+        deltas = np.diff(frames, axis = 0)
+        data = zlib.compress(pack_ints(frames[0]) + pack_ints(deltas[:1]) + pack_ints(np.diff(deltas, axis = 0)),
+                             self.compression)
+        self.file.write(DELTA_RECORD.pack(self.chunk_start, self.chunk_count, len(data)) + data)
+        self.chunk_count = 0
+
+    def __call__(self, i, agent_plot, param):
+        # observer of the engine, called after step i which yields step i+1
+        self.write(i + 1, agent_plot)
+
+    def wants_frame(self, i):
+        # only the stored steps are wrapped by the engine
+        return (i + 1) % self.stride == 0
+
+    def flush(self):
+        '''
+        Writes the frames so far to disk, the frames of an incomplete chunk form a record of their own
+        '''
+        self.write_chunk()
+        self.file.flush()
+
+    def close(self):
+        '''
+        Writes the remaining frames and closes the file
+        '''
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_delta_records(filename):
+    '''
+    Reads the header and the records of a delta trajectory
+
+    Returns
+    -------
+    header : dict
+    records : list of tuple
+        first frame, number of frames, offset and length of the data of every complete record.
+    end : int
+        end of the last complete record.
+
+    '''
+    with open(filename, "rb") as file:
+        if file.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+            raise ValueError(f"{filename} is not a delta trajectory.")
+        length, = struct.unpack("<i", file.read(4))
+        header = json.loads(file.read(length))
+        end = file.tell()
+        size = os.fstat(file.fileno()).st_size
+        records = []
+        while end + DELTA_RECORD.size <= size:
+            start, count, length = DELTA_RECORD.unpack(file.read(DELTA_RECORD.size))
+            if end + DELTA_RECORD.size + length > size:
+                break
+            records.append((start, count, end + DELTA_RECORD.size, length))
+            end += DELTA_RECORD.size + length
+            file.seek(end)
+
+    return header, records, end
+
+def is_delta_trajectory(filename):
+    with open(filename, "rb") as file:
+        return file.read(len(DELTA_MAGIC)) == DELTA_MAGIC
+
+class DeltaTrajectory:
+    '''
+    Read access to a delta trajectory of DeltaTrajectoryWriter, indexed like an array (frames,
+    n, d). Only the chunks holding the requested frames are read and decoded, the last decoded
+    chunk is kept, such that frames are read in sequence at the cost of one decoding per chunk.
+    Frames of a later record replace earlier ones (of a resumed run), frames that were never
+    written are zero.
+
+    Parameters
+    ----------
+    filename : str
+
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        header, self.records, end = read_delta_records(filename)
+        self.shape = (header["n_frames"], header["n"], header["d"])
+        self.dtype = np.dtype(header["dtype"])
+        self.origin = header["origin"]
+        self.quantum = header["quantum"]
+        # record of every frame, the last record holding a frame wins
+        self.owner = np.full(header["n_frames"], -1, dtype = np.intp)
+        for index, (start, count, offset, length) in enumerate(self.records):
+            self.owner[start:start + count] = index
+        self.cached = (None, None)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return 3
+
+    def decode(self, index):
+        '''
+        Quantized positions (count, n, d) of the frames of record index
+        '''
+        if self.cached[0] == index:
+            return self.cached[1]
+        start, count, offset, length = self.records[index]
+        with open(self.filename, "rb") as file:
+            file.seek(offset)
+            data = zlib.decompress(file.read(length))
+        size = self.shape[1] * self.shape[2]
+        key, data = unpack_ints(data, size)
+        first, data = unpack_ints(data, min(count - 1, 1) * size)
+        second, data = unpack_ints(data, max(count - 2, 0) * size)
+        # the deltas from the first one and the second differences, the frames from the deltas
+        deltas = np.empty((count - 1, size), dtype = np.int64)
+        deltas[:1] = first.reshape(-1, size)
+        np.cumsum(second.reshape(-1, size), axis = 0, out = deltas[1:])
+        deltas[1:] += deltas[:1]
+        frames = np.empty((count, size), dtype = np.int64)
+        frames[0] = key
+        np.cumsum(deltas, axis = 0, out = frames[1:])
+        frames[1:] += key
+        frames = frames.reshape(count, *self.shape[1:])
+        self.cached = (index, frames)
+
+        return frames
+
+    def read(self, frames):
+        '''
+        Positions of the frames (array of indices), one decoding per chunk
+        '''
+        out = np.zeros((len(frames),) + self.shape[1:], dtype = self.dtype)
+        owners = self.owner[frames]
+        for index in np.unique(owners[owners >= 0]):
+            rows = np.flatnonzero(owners == index)
+            decoded = self.decode(index)[frames[rows] - self.records[index][0]]
+            out[rows] = self.origin + decoded * self.quantum
+
+        return out
+
+    def __getitem__(self, key):
+        # frames are selected here, the agents and dimensions on the decoded frames
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+        if np.isscalar(key):
+            return self.read(np.arange(self.shape[0])[[key]])[0][rest]
+
+        return self.read(np.arange(self.shape[0])[key])[(slice(None),) + rest]
+
+    def __array__(self, dtype = None, copy = None):
+        positions = self.read(np.arange(self.shape[0]))
+
+        return positions if dtype is None else positions.astype(dtype)
+
+class AsyncTrajectoryWriter:
+    '''
+    Writes the frames of a trajectory writer in a background thread, such that the next steps
+    are computed while a frame is written. Frames are copied into one of n_buffers preallocated
+    buffers (in the dtype of the trajectory), which cycle between the simulation and the
+    thread through bounded queues: when all buffers wait to be written, the simulation blocks
+    until the thread has caught up (backpressure), so the memory use stays fixed.
+
+    Parameters
+    ----------
+    writer : TrajectoryWriter or DeltaTrajectoryWriter
+        writer of the frames, with write(step, positions), flush(), close() and a dtype.
+    n : int
+        number of agents.
+    d : int
+        number of dimensions.
+    n_buffers : int, optional
+        number of frames in flight. The default is 2 (double buffering).
+
+    '''
+    def __init__(self, writer, n, d, n_buffers = 2):
+        self.writer = writer
+        self.stride = writer.stride
+        self.error = None
+        self.free = queue.Queue()
+        for k in range(n_buffers):
+            self.free.put(np.empty((n, d), dtype = writer.dtype))
+        self.pending = queue.Queue(maxsize = n_buffers)
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def run(self):
+        # the writer thread, None stops it
+        while True:
+            item = self.pending.get()
+            try:
+                if item is None:
+                    return
+                step, frame = item
+                if self.error is None:
+                    self.writer.write(step, frame)
+                self.free.put(frame)
+            except Exception as error:
+                # raised in the simulation thread with the next frame
+                self.error = error
+                self.free.put(frame)
+            finally:
+                self.pending.task_done()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, step, positions):
+        '''
+        Queues the positions of step if it is a multiple of the stride, blocks while no buffer is free
+        '''
+        self.check()
+        if step % self.stride:
+            return
+        frame = self.free.get()
+        np.copyto(frame, positions, casting = "unsafe")
+        self.pending.put((step, frame))
+
+    def wants_frame(self, i):
+        return (i + 1) % self.stride == 0
+
+    def __call__(self, i, agent_plot, param):
+        # observer of the engine, called after step i which yields step i+1
+        if agent_plot is not None:
+            self.write(i + 1, agent_plot)
+
+    def flush(self):
+        '''
+        Waits until the queued frames are written, then writes them to disk
+        '''
+        self.pending.join()
+        self.check()
+        self.writer.flush()
+
+    def close(self):
+        '''
+        Writes the queued frames, stops the thread and closes the writer
+        '''
+        if self.thread.is_alive():
+            self.pending.put(None)
+            self.thread.join()
+        self.writer.close()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_trajectory(source):
+    '''
+    Opens a stored trajectory without loading it, frames are read when they are indexed
+
+    Parameters
+    ----------
+    source : str or array
+        filename of a .npy or a delta trajectory, arrays (and memory maps) are returned as they are.
+
+    Returns
+    -------
+    positions : array (frames, n, d)
+        read-only memory map for .npy files, DeltaTrajectory for delta trajectories.
+
+    '''
+    if isinstance(source, (str, os.PathLike)):
+        if is_delta_trajectory(source):
+            return DeltaTrajectory(source)
+        return np.load(source, mmap_mode = "r")
+
+    return source
+
+def read_metadata(filename):
+    '''
+    Reads the stride, number of frames and parameters stored next to a trajectory, None if the
+    trajectory was not written by TrajectoryWriter
+    '''
+    if not os.path.exists(metadata_filename(filename)):
+        return None
+    with open(metadata_filename(filename)) as file:
+        return json.load(file)